@@ -0,0 +1,85 @@
+#
+# python.py
+#
+# Copyright (c) 2013 Luis Garcia.
+# This source file is subject to terms of the MIT License. (See accompanying file LICENSE)
+#
+
+"""Python lexer code generator."""
+
+import os
+import generators.python_templates
+import spgen_parser
+import spgen_processor
+
+class Properties:
+	OUTPUT_PYTHON_MODULE = 'outputPythonModule'
+	OUTPUT_DIRECTORY = 'outputDirectory'
+	DEFAULT_MODULE_NAME = 'defaultModuleName'
+	GRAMMAR_FILE_NAME = 'grammarFileName'
+
+module_name = 'Python code generator'
+
+def generate_module_source(lexer_transition_table, rules, properties):
+	# The states are emitted as rows linked to each other rather than as code per
+	# state: CPython has no jump tables, so dispatching on the state in code costs a
+	# chain of comparisons per character, while a row lookup is one list index.
+	token_rules = [r for r, v in rules.items() if v.type == spgen_parser.RuleTypes.TOKEN]
+	rule_ids = dict((rule, index) for index, rule in enumerate(token_rules))
+
+	alphabet = lexer_transition_table.alphabet
+	class_count = alphabet.class_count
+
+	# Outside ASCII there are neither digits nor whitespace, so non-literal characters
+	# are either letters or others.
+	classes = [(chr(c), alphabet.classify(chr(c))) for c in range(128)]
+	classes.extend(sorted((c, cls) for c, cls in alphabet.char_classes.items() if ord(c) >= 128))
+
+	transitions = [
+		lexer_transition_table.transitions[s.index * class_count:(s.index + 1) * class_count]
+		for s in lexer_transition_table.states]
+
+	def accepts(channels):
+		return [
+			[rule_ids[r] for r in s.rules if lexer_transition_table.channels.get(r, spgen_parser.TokenChannels.DEFAULT) in channels]
+			if len(s.rules) > 0 else None
+			for s in lexer_transition_table.states]
+
+	return generators.python_templates.generate_module_template(
+		file_name = properties[Properties.OUTPUT_PYTHON_MODULE],
+		grammar_file = properties.get(Properties.GRAMMAR_FILE_NAME, ''),
+		module_name = properties[Properties.DEFAULT_MODULE_NAME],
+		rules = token_rules,
+		classes = classes,
+		letter_class = alphabet.kind_classes[spgen_processor.CharKind.LETTER],
+		other_class = alphabet.kind_classes[spgen_processor.CharKind.OTHER],
+		class_count = class_count,
+		transitions = transitions,
+		accepts = accepts([spgen_parser.TokenChannels.DEFAULT]),
+		hidden_accepts = accepts([spgen_parser.TokenChannels.DEFAULT, spgen_parser.TokenChannels.HIDDEN]))
+
+def generate_module_file(output_module_file, lexer_transition_table, rules, properties):
+	output = generate_module_source(lexer_transition_table, rules, properties)
+
+	with open(output_module_file, 'w') as f:
+		f.write(output)
+
+def generate_code(info):
+	if Properties.OUTPUT_PYTHON_MODULE not in info.properties:
+		info.properties[Properties.OUTPUT_PYTHON_MODULE] = '{0}Lexer.py'.format(info.properties[Properties.DEFAULT_MODULE_NAME])
+
+	print('Properties:')
+	for name, value in sorted(info.properties.items()):
+		print('    {0}: {1}'.format(name, value))
+
+	output_module_file = os.path.normpath(os.path.join(
+		os.getcwd(),
+		info.properties[Properties.OUTPUT_DIRECTORY],
+		info.properties[Properties.OUTPUT_PYTHON_MODULE]))
+	os.makedirs(os.path.dirname(output_module_file), exist_ok=True)
+
+	generate_module_file(
+		output_module_file,
+		info.lexer_transition_table,
+		info.rules,
+		info.properties)
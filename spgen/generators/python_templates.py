@@ -0,0 +1,116 @@
+#
+# python_templates.py
+#
+# Copyright (c) 2013 Luis Garcia.
+# This source file is subject to terms of the MIT License. (See accompanying file LICENSE)
+#
+
+_module_template = '''\
+#
+# {file_name}
+#
+# Generated by spgen from {grammar_file}. Do not edit.
+#
+
+"""Lexer for the {module_name} grammar."""
+
+class LexerError(Exception):
+	pass
+
+RULES = ({rules})
+
+{rule_ids}
+
+_CLASSES = {{
+{classes}}}
+
+_LETTER_CLASS = {letter_class}
+_OTHER_CLASS = {other_class}
+
+_TRANSITIONS = (
+{transitions})
+
+_ACCEPTS = ({accepts})
+
+_HIDDEN_ACCEPTS = ({hidden_accepts})
+
+# Every state is a row indexed by character class, holding the next row or None. The
+# rules emitted by an accepting state are stored after the last class, without and
+# with the hidden rules; skipped rules are never emitted.
+_ACCEPT = {class_count}
+_ACCEPT_HIDDEN = {class_count} + 1
+_ROWS = [list(row) + [accept, hidden_accept] for row, accept, hidden_accept in zip(_TRANSITIONS, _ACCEPTS, _HIDDEN_ACCEPTS)]
+for _row in _ROWS:
+	for _cls in range(_ACCEPT):
+		_row[_cls] = _ROWS[_row[_cls]] if _row[_cls] >= 0 else None
+_START = _ROWS[0]
+del _row, _cls
+
+def tokenize(text, hidden=False):
+	"""Returns the (offset, length, rule id) tuples of the tokens of the text."""
+
+	output = []
+	append = output.append
+	get_class = _CLASSES.get
+	length = len(text)
+	emit = _ACCEPT_HIDDEN if hidden else _ACCEPT
+
+	offset = 0
+	while offset < length:
+		row = _START
+		index = offset
+		accept_index = offset
+		accept = ()
+
+		while index < length:
+			char = text[index]
+			cls = get_class(char)
+			if cls is None:
+				cls = _LETTER_CLASS if char.isalpha() else _OTHER_CLASS
+
+			row = row[cls]
+			if row is None:
+				break
+
+			index += 1
+			if row[emit] is not None:
+				accept = row[emit]
+				accept_index = index
+
+		if accept_index == offset:
+			if index == length:
+				raise LexerError('End of file found without any matching rule.')
+			raise LexerError('Failed to match \\'{{0}}\\' character'.format(text[index]))
+
+		for rule in accept:
+			append((offset, accept_index - offset, rule))
+		offset = accept_index
+
+	return output
+'''
+
+def _format_rows(rows, indent='\t'):
+	return ''.join('{0}({1}),\n'.format(indent, ', '.join(str(t) for t in row) + (',' if len(row) == 1 else '')) for row in rows)
+
+def _format_tuple(items):
+	return ', '.join(items) + (',' if len(items) == 1 else '')
+
+def _format_accepts(accepts):
+	return _format_tuple(['(' + _format_tuple([str(r) for r in accept]) + ')' if accept is not None else 'None' for accept in accepts])
+
+def generate_module_template(file_name, grammar_file, module_name, rules, classes, letter_class, other_class, class_count, transitions, accepts, hidden_accepts):
+	return _module_template.format(
+		file_name = file_name,
+		grammar_file = grammar_file,
+		module_name = module_name,
+		rules = _format_tuple([repr(rule) for rule in rules]),
+		rule_ids = '\n'.join('{0}Token = {1}'.format(rule, index) for index, rule in enumerate(rules)),
+		classes = ''.join(
+			'\t' + ' '.join('{0}: {1},'.format(ascii(char), cls) for char, cls in classes[i:i + 8]) + '\n'
+			for i in range(0, len(classes), 8)),
+		letter_class = letter_class,
+		other_class = other_class,
+		class_count = class_count,
+		transitions = _format_rows(transitions),
+		accepts = _format_accepts(accepts),
+		hidden_accepts = _format_accepts(hidden_accepts))
@@ -49,7 +49,7 @@ def generate_code(output_language, transition_table, properties, rules):
 
 def main(args):
 	try:
-		grammar_file, output_language = read_arguments(args)
+		grammar_file, output_language, minimize = read_arguments(args)
 
 		context = parser.Context()
 		context.properties['outputLanguage'] = output_language
@@ -60,9 +60,20 @@ def main(args):
 		context.properties['grammarFileName'] = os.path.basename(grammar_file)
 
 		parser.Parser().process_file(grammar_file, context)
-		nfa_graph = processor.NFAGraphGenerator().generate(context)
+		nfa_generator = processor.NFAGraphGenerator()
+		nfa_graph = nfa_generator.generate(context)
+		print('NFA states: {0} ({1} copied from fragments)'.format(len(nfa_graph.states), nfa_generator.copied_state_count))
 		dfa_graph = processor.DFAGraphGenerator().generate(nfa_graph)
-		transition_table = processor.TransitionTableGenerator().generate(dfa_graph)
+		if minimize:
+			state_count = len(dfa_graph.states)
+			dfa_graph = processor.DFAMinimizer().minimize(dfa_graph)
+			print('DFA states: {0} ({1} before minimization)'.format(len(dfa_graph.states), state_count))
+		else:
+			print('DFA states: {0}'.format(len(dfa_graph.states)))
+		token_rules = [r for r in context.rules.values() if r.type == parser.RuleTypes.TOKEN]
+		transition_table = processor.TransitionTableGenerator().generate(dfa_graph,
+			[r.name for r in token_rules],
+			dict((r.name, r.channel) for r in token_rules))
 
 		default_output_directory = os.path.dirname(os.path.abspath(grammar_file))
 		if 'outputDirectory' in context.properties:
@@ -86,24 +97,27 @@ def main(args):
 def read_arguments(args):
 	grammar_file = ''
 	output_language = ''
+	minimize = True
 
 	try:
-		opts, args = getopt.getopt(args, 'g:l:', [ 'grammar=lang=' ])
+		opts, args = getopt.getopt(args, 'g:l:', [ 'grammar=lang=', 'no-minimize' ])
 		for opt, arg in opts:
 			if opt in ('-g', '--grammar'):
 				grammar_file = arg
 			elif opt in ('-l', '--lang'):
 				output_language = arg
+			elif opt == '--no-minimize':
+				minimize = False
 	except getopt.GetoptError as err:
 		raise CommandArgumentsError(err.msg)
 
 	if grammar_file == '' or output_language == '':
 		raise CommandArgumentsError('You must specify an input grammar file and the output language.')
 
-	return grammar_file, output_language
+	return grammar_file, output_language, minimize
 
 def usage():
-	print('Usage: python spgen.py -g <input-file> -l <language>')
+	print('Usage: python spgen.py -g <input-file> -l <language> [--no-minimize]')
 	print('Version: ' + version)
 	print('Copyright (c) 2013 Luis Garcia')
 	print('')
@@ -0,0 +1,263 @@
+#
+# spgen_benchmark.py
+#
+# Copyright (c) 2013 Luis Garcia.
+# This source file is subject to terms of the MIT License. (See accompanying file LICENSE)
+#
+
+"""Benchmarks for the lexer processor."""
+
+import sys
+import time
+import tracemalloc
+import types
+import generators.python
+import spgen_processor
+from spgen_parser import *
+from spgen_processor import *
+from spgen_regex import *
+
+try:
+	import spgen_numpy
+except ImportError:
+	spgen_numpy = None
+
+def create_transition_table(grammar):
+	context = Context()
+	Parser().free_context(SourceIterator(grammar), context)
+	nfa_graph = NFAGraphGenerator().generate(context)
+	dfa_graph = DFAGraphGenerator().generate(nfa_graph)
+	token_rules = [r for r in context.rules.values() if r.type == RuleTypes.TOKEN]
+	return TransitionTableGenerator().generate(dfa_graph,
+		[r.name for r in token_rules],
+		dict((r.name, r.channel) for r in token_rules))
+
+def create_python_lexer(grammar):
+	# Generates the module of the Python target and imports it without writing it.
+	context = Context()
+	context.properties['defaultModuleName'] = 'Benchmark'
+	context.properties['outputPythonModule'] = 'BenchmarkLexer.py'
+	Parser().free_context(SourceIterator(grammar), context)
+	source = generators.python.generate_module_source(create_transition_table(grammar), context.rules, context.properties)
+
+	module = types.ModuleType('BenchmarkLexer')
+	exec(compile(source, 'BenchmarkLexer.py', 'exec'), module.__dict__)
+	return module
+
+def create_master_pattern(grammar):
+	context = Context()
+	Parser().free_context(SourceIterator(grammar), context)
+	return MasterPatternGenerator().generate(context, create_transition_table(grammar))
+
+def measure(function, *args):
+	start = time.perf_counter()
+	function(*args)
+	return time.perf_counter() - start
+
+def measure_memory(function, *args):
+	# Returns the size of the result, not counting what was freed while computing it.
+	tracemalloc.start()
+	result = function(*args)
+	size = tracemalloc.get_traced_memory()[0]
+	tracemalloc.stop()
+	del result
+	return size
+
+def print_table(title, header, rows):
+	print(title)
+	print('    ' + ''.join('{0:>14}'.format(h) for h in header))
+	for row in rows:
+		print('    ' + ''.join('{0:>14}'.format(c if isinstance(c, str) else '{0:.4f}'.format(c)) for c in row))
+	print('')
+
+def benchmark_maximal_munch():
+	# Inputs where a long prefix of a rule usually fails take quadratic time with plain
+	# backtracking, and linear time when failed (state, position) pairs are remembered.
+	cases = [
+		('\'a\'* \'b\' | \'a\' on a^n', """ token a : 'a'* 'b' | 'a' ; """, lambda n: 'a' * n),
+		('(\'ab\' | \'a\')* \'c\' | \'a\' on (ab)^n', """ token a : ('ab' | 'a')* 'c' | 'a' ; token b : 'b' ; """, lambda n: 'ab' * (n // 2)),
+	]
+
+	for title, grammar, generate_text in cases:
+		table = create_transition_table(grammar)
+		rows = []
+		for n in [500, 1000, 2000, 4000]:
+			text = generate_text(n)
+			rows.append((str(n),
+				measure(TransitionTableTraverser().traverse, table, text),
+				measure(TransitionTableTraverser(linear=True).traverse, table, text)))
+		for n in [40000, 80000, 160000]:
+			text = generate_text(n)
+			rows.append((str(n), '-', measure(TransitionTableTraverser(linear=True).traverse, table, text)))
+		print_table('Maximal munch, ' + title, ['n', 'default (s)', 'linear (s)'], rows)
+
+def benchmark_token_output():
+	table = create_transition_table(""" token Whitespace : '\\s' ;
+	                                    token Identifier : '\\w' ('\\w' | '\\d')* ;
+	                                    token Number     : '\\d'+ ; """)
+	rows = []
+	for n in [10000, 100000]:
+		text = 'abc 12 x1 ' * n
+		rows.append((str(n * 6),
+			measure(TransitionTableTraverser().traverse, table, text),
+			measure(TransitionTableTraverser().traverse_arrays, table, text),
+			'{0:.1f}'.format(measure_memory(TransitionTableTraverser().traverse, table, text) / 2 ** 20),
+			'{0:.1f}'.format(measure_memory(TransitionTableTraverser().traverse_arrays, table, text) / 2 ** 20)))
+	print_table('Token output, list of tuples vs arrays', ['tokens', 'list (s)', 'arrays (s)', 'list (MB)', 'arrays (MB)'], rows)
+
+def benchmark_incremental():
+	table = create_transition_table(""" token Whitespace : '\\s' ;
+	                                    token Identifier : '\\w' ('\\w' | '\\d')* ;
+	                                    token Number     : '\\d'+ ; """)
+	rows = []
+	for n in [10000, 100000]:
+		text = 'abc 12 x1 ' * n
+		traverser = IncrementalTraverser(table, text)
+		middle = len(text) // 2
+		rows.append((str(len(text)),
+			measure(TransitionTableTraverser().traverse, table, text),
+			measure(traverser.edit, middle, 1, 'q'),
+			measure(traverser.edit, middle, 0, 'q')))
+	print_table('Incremental lexing, one character edit in the middle', ['chars', 'full (s)', 'replace (s)', 'insert (s)'], rows)
+
+def benchmark_batch():
+	table = create_transition_table(""" token Whitespace : '\\s' -> skip ;
+	                                    token Identifier : '\\w' ('\\w' | '\\d')* ;
+	                                    token Number     : '\\d'+ ;
+	                                    token Colon      : ':' ; """)
+	traverser = TransitionTableTraverser()
+	numpy_table = spgen_numpy.NumpyTransitionTableGenerator().generate(table) if spgen_numpy is not None else None
+	rows = []
+	for n in [10000, 100000]:
+		texts = ['host{0}: error 42 at x{0}'.format(i) for i in range(n)]
+		rows.append((str(n),
+			measure(lambda: [traverser.traverse(table, text) for text in texts]),
+			measure(traverser.traverse_batch, table, texts),
+			measure(spgen_numpy.NumpyBatchTraverser().traverse_batch, numpy_table, texts) if numpy_table is not None else '-'))
+	print_table('Lexing short strings, one call per string vs batch', ['strings', 'calls (s)', 'batch (s)', 'numpy (s)'], rows)
+
+def benchmark_line_index():
+	table = create_transition_table(""" token Whitespace : '\\s' ;
+	                                    token Identifier : '\\w' ('\\w' | '\\d')* ;
+	                                    token Number     : '\\d'+ ; """)
+	rows = []
+	for n in [1000, 4000]:
+		text = 'abc 12 x1\n' * n
+		offsets = [offset for offset, length, rule in TransitionTableTraverser().traverse(table, text)]
+
+		def rescan():
+			return [(text.count('\n', 0, offset) + 1, offset - text.rfind('\n', 0, offset)) for offset in offsets]
+
+		def index():
+			return LineIndex(text).positions(offsets)
+
+		rows.append((str(len(offsets)), measure(rescan), measure(index)))
+	print_table('Line and column of every token', ['tokens', 'rescan (s)', 'index (s)'], rows)
+
+def benchmark_classification():
+	table = create_transition_table(""" token Whitespace : '\\s' ;
+	                                    token Identifier : '\\w' ('\\w' | '\\d')* ;
+	                                    token Number     : '\\d'+ ; """)
+	alphabet = table.alphabet
+
+	def reference(text):
+		# The classification without the ASCII table and the cache.
+		kind_classes = alphabet.kind_classes
+		char_classes = alphabet.char_classes
+		for char in text:
+			if char not in char_classes:
+				kind_classes[spgen_processor._classify_char(char)]
+
+	def classify(text):
+		for char in text:
+			alphabet.classify(char)
+
+	numpy_table = spgen_numpy.NumpyTransitionTableGenerator().generate(table) if spgen_numpy is not None else None
+	rows = []
+	for title, text in [('ascii', 'abc 12 x1 ' * 20000), ('unicode', 'número 12 家x ' * 20000)]:
+		rows.append((title,
+			measure(reference, text) / len(text) * 1e9,
+			measure(classify, text) / len(text) * 1e9,
+			measure(numpy_table.classify, text) / len(text) * 1e9 if numpy_table is not None else '-',
+			measure(TransitionTableTraverser().traverse, table, text) / len(text) * 1e9,
+			measure(spgen_numpy.NumpyTraverser().traverse, numpy_table, text) / len(text) * 1e9 if numpy_table is not None else '-'))
+	print_table('Character classification, per character',
+		['text', 'uncached (ns)', 'cached (ns)', 'numpy (ns)', 'traverse (ns)', 'np lex (ns)'], rows)
+
+def benchmark_self_loops():
+	grammar = """ token Whitespace : '\\s'+ ;
+	              token Identifier : '\\w' ('\\w' | '\\d')* ;
+	              token Number     : '\\d'+ ; """
+	table = create_transition_table(grammar)
+	plain_table = create_transition_table(grammar)
+	for state in plain_table.states:
+		state.skip = None
+
+	rows = []
+	for length in [1, 4, 16, 64]:
+		text = ('x' * length + ' ' * length + '1' * length + ' ') * (200000 // (3 * length + 1))
+		rows.append((str(length),
+			measure(TransitionTableTraverser().traverse, plain_table, text),
+			measure(TransitionTableTraverser().traverse, table, text)))
+	print_table('Runs of self-loop states, 200000 chars', ['run length', 'stepping (s)', 'skipping (s)'], rows)
+
+# Grammars compared by the benchmarks of the lexers built from a transition table.
+lexer_keywords = 'if else while for return break continue def class import from as with try except finally raise yield'.split()
+lexer_cases = [
+	('identifiers', """ token Whitespace : '\\s' ;
+	                    token Identifier : Letter LetterOrDigit* ;
+	                    token FixedToken : 'token' ;
+	                    token Equal      : '==' ;
+	                    token NotEqual   : '!=' ;
+	                    token Not        : '!' ;
+	                    token Assign     : '=' ;
+	                    fragment LetterOrDigit : Letter | Digit ;
+	                    fragment Letter  : '\\w' ;
+	                    fragment Digit   : '\\d' ; """,
+		'token abc == x1 != !y = zz ' * 20000),
+	('keywords', ''.join(' token K{0} : \'{1}\' ;'.format(i, k) for i, k in enumerate(lexer_keywords)) +
+		""" token Identifier : '\\w' ('\\w' | '\\d')* ;
+		    token Whitespace : '\\s'+ ;
+		    token Number     : '\\d'+ ; """,
+		'if x1 else while foo for bar return 42 class Baz import q ' * 10000),
+]
+
+def benchmark_generated_module():
+	rows = []
+	for title, grammar, text in lexer_cases:
+		table = create_transition_table(grammar)
+		lexer = create_python_lexer(grammar)
+		traverse_time = measure(TransitionTableTraverser().traverse, table, text)
+		module_time = measure(lexer.tokenize, text)
+		rows.append((title, str(len(text)), traverse_time, module_time, '{0:.1f}x'.format(traverse_time / module_time)))
+	print_table('Generated Python module vs traverser', ['grammar', 'chars', 'traverse (s)', 'module (s)', 'speedup'], rows)
+
+def benchmark_master_pattern():
+	rows = []
+	for title, grammar, text in lexer_cases:
+		master_pattern = create_master_pattern(grammar)
+		assert master_pattern.fallback_reason is None, master_pattern.fallback_reason
+		traverse_time = measure(TransitionTableTraverser().traverse, master_pattern.transition_table, text)
+		pattern_time = measure(MasterPatternTraverser().traverse, master_pattern, text)
+		rows.append((title, str(len(text)), traverse_time, pattern_time, '{0:.1f}x'.format(traverse_time / pattern_time)))
+	print_table('Master pattern vs traverser', ['grammar', 'chars', 'traverse (s)', 'pattern (s)', 'speedup'], rows)
+
+benchmarks = [
+	benchmark_maximal_munch,
+	benchmark_token_output,
+	benchmark_incremental,
+	benchmark_batch,
+	benchmark_line_index,
+	benchmark_classification,
+	benchmark_self_loops,
+	benchmark_generated_module,
+	benchmark_master_pattern,
+]
+
+def main(args):
+	for benchmark in benchmarks:
+		if len(args) == 0 or benchmark.__name__ in args:
+			benchmark()
+
+if __name__ == '__main__':
+	main(sys.argv[1:])
@@ -0,0 +1,257 @@
+#
+# spgen_numpy.py
+#
+# Copyright (c) 2013 Luis Garcia.
+# This source file is subject to terms of the MIT License. (See accompanying file LICENSE)
+#
+
+import numpy
+from array import array
+from spgen_parser import *
+from spgen_processor import *
+
+class NumpyTransitionTable:
+	def __init__(self):
+		self._transition_table = None
+		self._transitions = None
+		self._accepting = None
+		self._accept_rules = None
+		self._ascii_classes = None
+		self._range_starts = None
+		self._range_classes = None
+
+	def __repr__(self):
+		return '{0} {1}'.format(self.__class__.__name__, str(self.__dict__))
+
+	@property
+	def transition_table(self):
+		return self._transition_table
+
+	@transition_table.setter
+	def transition_table(self, value):
+		self._transition_table = value
+
+	@property
+	def transitions(self):
+		return self._transitions
+
+	@transitions.setter
+	def transitions(self, value):
+		self._transitions = value
+
+	@property
+	def accepting(self):
+		return self._accepting
+
+	@accepting.setter
+	def accepting(self, value):
+		self._accepting = value
+
+	@property
+	def accept_rules(self):
+		return self._accept_rules
+
+	@accept_rules.setter
+	def accept_rules(self, value):
+		self._accept_rules = value
+
+	@property
+	def ascii_classes(self):
+		return self._ascii_classes
+
+	@ascii_classes.setter
+	def ascii_classes(self, value):
+		self._ascii_classes = value
+
+	@property
+	def range_starts(self):
+		return self._range_starts
+
+	@range_starts.setter
+	def range_starts(self, value):
+		self._range_starts = value
+
+	@property
+	def range_classes(self):
+		return self._range_classes
+
+	@range_classes.setter
+	def range_classes(self, value):
+		self._range_classes = value
+
+	def classify(self, text):
+		# Maps every character of the text to its class in one pass over arrays. ASCII
+		# characters are looked up in a table, and others in the runs of code points
+		# that share a class.
+		code_points = numpy.frombuffer(text.encode('utf-32-le', 'surrogatepass'), dtype=numpy.uint32)
+		ascii = code_points < 128
+		if ascii.all():
+			return self._ascii_classes[code_points]
+
+		classes = numpy.empty(len(code_points), dtype=numpy.int32)
+		classes[ascii] = self._ascii_classes[code_points[ascii]]
+		other = ~ascii
+		classes[other] = self._range_classes[numpy.searchsorted(self._range_starts, code_points[other], 'right') - 1]
+		return classes
+
+class NumpyTransitionTableGenerator:
+	# Lays out a transition table as dense NumPy arrays: the transitions as a (state,
+	# class) matrix, the class of every ASCII character, and the runs of other code
+	# points that share a class. The accept rules hold, for every state, the index of
+	# its rule in the rules of the table, or -1.
+
+	def generate(self, transition_table):
+		table = NumpyTransitionTable()
+		table.transition_table = transition_table
+
+		class_count = transition_table.alphabet.class_count
+		table.transitions = numpy.array(transition_table.transitions, dtype=numpy.int32).reshape(-1, class_count)
+		table.accepting = numpy.array([len(s.rules) > 0 for s in transition_table.states], dtype=bool)
+		table.accept_rules = numpy.array([
+			transition_table.rules.index(s.rules[0]) if len(s.rules) > 0 else -1
+			for s in transition_table.states], dtype=numpy.int32)
+
+		alphabet = transition_table.alphabet
+		table.ascii_classes = numpy.array([alphabet.classify(chr(c)) for c in range(128)], dtype=numpy.int32)
+		starts, classes = self.class_ranges(alphabet)
+		table.range_starts = numpy.array(starts, dtype=numpy.uint32)
+		table.range_classes = numpy.array(classes, dtype=numpy.int32)
+		return table
+
+	def class_ranges(self, alphabet):
+		# The first code point and class of every run of non-ASCII code points that
+		# share a class.
+		runs = [(max(first, 128), cls) for first, last, cls in alphabet.class_runs() if last >= 128]
+		return [first for first, cls in runs], [cls for first, cls in runs]
+
+class NumpyTraverser:
+	# Classifies the whole text with NumPy before lexing it, so the maximal munch steps
+	# only look up integers. The output is the same as TransitionTableTraverser.traverse();
+	# the linear and recovery modes are only available there.
+
+	def __init__(self, hidden=False):
+		self._hidden = hidden
+
+	@property
+	def hidden(self):
+		return self._hidden
+
+	def traverse(self, numpy_table, text):
+		return TransitionTableTraverser(hidden=self._hidden).traverse_classes(
+			numpy_table.transition_table, text, numpy_table.classify(text).tolist())
+
+class NumpyBatchTraverser:
+	# Lexes a batch of strings running the DFA on all of them at once: every step moves
+	# each string that is still being lexed by one character, with a few operations on
+	# whole arrays. Every string keeps its own token start, state and last accepting
+	# state, so maximal munch backtracks on each string independently. The output is
+	# the same as TransitionTableTraverser.traverse_batch().
+
+	def __init__(self, hidden=False):
+		self._hidden = hidden
+
+	@property
+	def hidden(self):
+		return self._hidden
+
+	def traverse_batch(self, numpy_table, texts):
+		transition_table = numpy_table.transition_table
+		rules = transition_table.rules
+
+		channels = [TokenChannels.DEFAULT, TokenChannels.HIDDEN] if self._hidden else [TokenChannels.DEFAULT]
+		emitted = numpy.array([transition_table.channels.get(r, TokenChannels.DEFAULT) in channels for r in rules] + [False])
+
+		# The state after NO_MOVE (-1) reads the last entry, which is never accepting.
+		accepting = numpy.append(numpy_table.accepting, False)
+		accept_rules = numpy_table.accept_rules
+		transitions = numpy_table.transitions
+
+		joined = ''.join(texts)
+		classes = numpy.append(numpy_table.classify(joined), 0)
+
+		lengths = numpy.fromiter((len(text) for text in texts), dtype=numpy.int64, count=len(texts))
+		bases = numpy.zeros(len(texts), dtype=numpy.int64)
+		numpy.cumsum(lengths[:-1], out=bases[1:])
+
+		# The strings being lexed, with their positions in the joined text.
+		lanes = numpy.nonzero(lengths > 0)[0]
+		ends = bases[lanes] + lengths[lanes]
+		starts = bases[lanes]
+		positions = starts.copy()
+		states = numpy.zeros(len(lanes), dtype=numpy.int32)
+		accept_states = numpy.full(len(lanes), -1, dtype=numpy.int32)
+		accept_positions = starts.copy()
+
+		token_lanes = []
+		token_starts = []
+		token_ends = []
+		token_rules = []
+		failures = {}
+
+		while len(lanes) > 0:
+			at_end = positions == ends
+			next_states = numpy.where(at_end, TransitionTable.NO_MOVE, transitions[states, classes[positions]])
+			moved = next_states != TransitionTable.NO_MOVE
+
+			states = numpy.where(moved, next_states, states)
+			positions = positions + moved
+			accepted = moved & accepting[next_states]
+			accept_states = numpy.where(accepted, states, accept_states)
+			accept_positions = numpy.where(accepted, positions, accept_positions)
+
+			finished = ~moved
+			if not finished.any():
+				continue
+
+			failed = finished & (accept_states == -1)
+			for index in numpy.nonzero(failed)[0]:
+				if at_end[index]:
+					failures[int(lanes[index])] = 'End of file found without any matching rule.'
+				else:
+					failures[int(lanes[index])] = 'Failed to match \'{0}\' character'.format(joined[positions[index]])
+
+			matched = finished & ~failed
+			rule_ids = accept_rules[accept_states]
+			matched_emitted = matched & emitted[rule_ids]
+			token_lanes.append(lanes[matched_emitted])
+			token_starts.append(starts[matched_emitted])
+			token_ends.append(accept_positions[matched_emitted])
+			token_rules.append(rule_ids[matched_emitted])
+
+			positions = numpy.where(matched, accept_positions, positions)
+			starts = numpy.where(matched, accept_positions, starts)
+			states = numpy.where(matched, 0, states)
+			accept_states = numpy.where(matched, -1, accept_states)
+
+			active = ~failed & (starts < ends)
+			if not active.all():
+				lanes = lanes[active]
+				ends = ends[active]
+				starts = starts[active]
+				positions = positions[active]
+				states = states[active]
+				accept_states = accept_states[active]
+				accept_positions = accept_positions[active]
+
+		if len(failures) > 0:
+			index = min(failures)
+			raise LexerError('String {0}: {1}'.format(index, failures[index]))
+
+		return self._token_batch(rules, bases, len(texts), token_lanes, token_starts, token_ends, token_rules)
+
+	def _token_batch(self, rules, bases, text_count, token_lanes, token_starts, token_ends, token_rules):
+		token_lanes = numpy.concatenate(token_lanes or [numpy.zeros(0, dtype=numpy.int64)])
+		token_starts = numpy.concatenate(token_starts or [numpy.zeros(0, dtype=numpy.int64)])
+		token_ends = numpy.concatenate(token_ends or [numpy.zeros(0, dtype=numpy.int64)])
+		token_rules = numpy.concatenate(token_rules or [numpy.zeros(0, dtype=numpy.int32)])
+
+		# Tokens are found in step order; the starts of the tokens sort them by string.
+		order = numpy.argsort(token_starts, kind='stable')
+		token_lanes = token_lanes[order]
+
+		tokens = TokenBatch(rules)
+		tokens.offsets.frombytes((token_starts[order] - bases[token_lanes]).astype(numpy.int64).tobytes())
+		tokens.lengths.frombytes((token_ends[order] - token_starts[order]).astype(numpy.int64).tobytes())
+		tokens.rule_ids.frombytes(token_rules[order].astype(numpy.int32).tobytes())
+		tokens.starts.frombytes(numpy.cumsum(numpy.bincount(token_lanes, minlength=text_count)).astype(numpy.int64).tobytes())
+		return tokens
@@ -35,10 +35,16 @@ class PropertyInfo:
 	def value(self):
 		return self._value
 
+class TokenChannels:
+	DEFAULT = 1
+	HIDDEN = 2
+	SKIP = 3
+
 class TokenInfo:
-	def __init__(self, name, grammar):
+	def __init__(self, name, grammar, channel=TokenChannels.DEFAULT):
 		self._name = name
 		self._grammar = grammar
+		self._channel = channel
 
 	def __repr__(self):
 		return '{} {}'.format(self.__class__.__name__, str(self.__dict__))
@@ -54,6 +60,10 @@ class TokenInfo:
 	def grammar(self):
 		return self._grammar
 
+	@property
+	def channel(self):
+		return self._channel
+
 class FragmentInfo:
 	def __init__(self, name, grammar):
 		self._name = name
@@ -125,10 +135,11 @@ def recognize_input_scape(str_):
 	return out
 
 class RuleInfo:
-	def __init__(self, name, rule_type, grammar):
+	def __init__(self, name, rule_type, grammar, channel=TokenChannels.DEFAULT):
 		self._name = name
 		self._type = rule_type
 		self._grammar = grammar
+		self._channel = channel
 
 	def __repr__(self):
 		return '{} {}'.format(self.__class__.__name__, str(self.__dict__))
@@ -148,6 +159,10 @@ class RuleInfo:
 	def grammar(self):
 		return self._grammar
 
+	@property
+	def channel(self):
+		return self._channel
+
 class Context:
 	def __init__(self):
 		self._properties = {}
@@ -315,7 +330,7 @@ class Parser:
 
 			success, token_info = self.try_token(source_iterator)
 			if success:
-				context.rules[token_info.name] = RuleInfo(token_info.name, RuleTypes.TOKEN, token_info.grammar)
+				context.rules[token_info.name] = RuleInfo(token_info.name, RuleTypes.TOKEN, token_info.grammar, token_info.channel)
 				continue
 
 			success, fragment_info = self.try_fragment(source_iterator)
@@ -384,9 +399,11 @@ class Parser:
 			name = self.expect_identifier(source_iterator)
 			if name is not None and self.expect_token(source_iterator, ':', alphanumeric_token = False):
 				grammar = self.expect_token_grammar(source_iterator)
-				if grammar is not None and self.expect_token(source_iterator, ';', alphanumeric_token = False):
-					source_iterator.release()
-					return True, TokenInfo(name, grammar)
+				if grammar is not None:
+					channel = self.expect_token_channel(source_iterator)
+					if channel is not None and self.expect_token(source_iterator, ';', alphanumeric_token = False):
+						source_iterator.release()
+						return True, TokenInfo(name, grammar, channel)
 
 		source_iterator.restore()
 		return False, None
@@ -405,6 +422,24 @@ class Parser:
 		source_iterator.restore()
 		return False, None
 
+	def expect_token_channel(self, source_iterator):
+		# An optional '-> skip' or '-> hidden' after the grammar of a token.
+		if not self.expect_token(source_iterator, '->', alphanumeric_token = False):
+			return TokenChannels.DEFAULT
+
+		source_iterator.backup()
+		channels = {
+			'skip'   : TokenChannels.SKIP,
+			'hidden' : TokenChannels.HIDDEN }
+
+		name = self.expect_identifier(source_iterator)
+		if name in channels:
+			source_iterator.release()
+			return channels[name]
+
+		source_iterator.restore()
+		return None
+
 	def expect_token(self, source_iterator, token, alphanumeric_token):
 		source_iterator.backup()
 		self.skip_whitespace(source_iterator)
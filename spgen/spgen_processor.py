@@ -7,26 +7,83 @@
 
 from spgen_parser import *
 from collections import deque
+from array import array
+import bisect
+import concurrent.futures
+import functools
+import os
+import re
 import string
 import unicodedata
-
-def _is_digit(char):
-	return char in string.digits
-
-def _is_letter(char):
-	return unicodedata.category(char) in ['Ll', 'Lm', 'Lo', 'Lt', 'Lu']
-
-def _is_whitespace(char):
-	return char in string.whitespace
+import weakref
+
+# Kinds of characters that are not literals of the grammar. Any character belongs
+# exactly to one of them, so they can be used as the default equivalence classes.
+class CharKind:
+	OTHER = 0
+	DIGIT = 1
+	LETTER = 2
+	WHITESPACE = 3
+	COUNT = 4
+
+# The kinds of ASCII characters are looked up in a table, and the kinds of other
+# characters are cached, since unicodedata.category() is slow.
+def _classify_char(char):
+	if char in string.digits:
+		return CharKind.DIGIT
+	if unicodedata.category(char) in ['Ll', 'Lm', 'Lo', 'Lt', 'Lu']:
+		return CharKind.LETTER
+	if char in string.whitespace:
+		return CharKind.WHITESPACE
+	return CharKind.OTHER
+
+_ASCII_KINDS = [_classify_char(chr(c)) for c in range(128)]
+
+@functools.lru_cache(maxsize=4096)
+def _non_ascii_kind(char):
+	# Outside ASCII there are neither digits nor whitespace.
+	return CharKind.LETTER if char.isalpha() else CharKind.OTHER
+
+def _char_kind(char):
+	if char < '\x80':
+		return _ASCII_KINDS[ord(char)]
+	return _non_ascii_kind(char)
+
+_MAX_CODE_POINT = 0x10FFFF
+_char_kind_intervals_cache = None
+
+def char_kind_intervals():
+	# Runs of consecutive code points of the same kind, as (first, last, kind) tuples.
+	# Outside ASCII there are no digits or whitespace, and str.isalpha() tests the same
+	# categories as _classify_char() much faster.
+
+	global _char_kind_intervals_cache
+	if _char_kind_intervals_cache is None:
+		kinds = list(_ASCII_KINDS)
+		kinds.extend(CharKind.LETTER if chr(c).isalpha() else CharKind.OTHER for c in range(128, _MAX_CODE_POINT + 1))
+
+		intervals = []
+		first = 0
+		for c in range(1, _MAX_CODE_POINT + 1):
+			if kinds[c] != kinds[first]:
+				intervals.append((first, c - 1, kinds[first]))
+				first = c
+		intervals.append((first, _MAX_CODE_POINT, kinds[first]))
+		_char_kind_intervals_cache = intervals
+	return _char_kind_intervals_cache
 
 class LexerError(Exception):
 	pass
 
 class LexerInput:
-	_BAG = {}
+	# Inputs are shared, so that they can be compared by identity. The bag only holds
+	# them weakly, so the inputs of characters are freed once no graph uses them.
+	_BAG = weakref.WeakValueDictionary()
 
 	def __init__(self, value):
 		self._value = value
+		# The kind of a char input is computed once, as inputs are shared.
+		self._kind = _char_kind(value[1]) if value[0] == 'Z' else None
 
 	def __repr__(self):
 		return '{0}({1})'.format(self.__class__.__name__, self._value)
@@ -52,9 +109,15 @@ class LexerInput:
 		return LexerInput._generate('Z' + char)
 
 	def _generate(name):
-		if name not in LexerInput._BAG:
-			LexerInput._BAG[name] = LexerInput(name)
-		return LexerInput._BAG[name]
+		result = LexerInput._BAG.get(name)
+		if result is None:
+			result = LexerInput(name)
+			LexerInput._BAG[name] = result
+		return result
+
+	def interned_count():
+		# The number of inputs currently shared, for checking memory usage.
+		return len(LexerInput._BAG)
 
 	def _is_char(self):
 		return self._value[0] == 'Z'
@@ -63,44 +126,48 @@ class LexerInput:
 		return self._value[1]
 
 	def match(a, b):
-		# Note that this algorithm depends of the ordering of value of special tokens.
+		# Note that this algorithm depends of the ordering of value of special tokens. Inputs
+		# are shared, so they are compared by identity.
+
+		if a._kind is not None and b._kind is not None:
+			return a is b
 
 		if b < a: return LexerInput.match(b, a)
 
-		if a != LexerInput.DEFAULT and a == b:
+		if a is not LexerInput.DEFAULT and a is b:
 			return True
 
-		if a == LexerInput.ANY:
+		if a is LexerInput.ANY:
 			return True
 
-		if a == LexerInput.DIGIT:
+		if a is LexerInput.DIGIT:
 			if b._is_char():
-				return _is_digit(b._get_char())
-			elif b == LexerInput.NON_LETTER:
+				return b._kind == CharKind.DIGIT
+			elif b is LexerInput.NON_LETTER:
 				return True
 			return False
 
-		if a == LexerInput.NON_DIGIT:
+		if a is LexerInput.NON_DIGIT:
 			if b._is_char():
-				return not _is_digit(b._get_char())
+				return b._kind != CharKind.DIGIT
 			return True
 
-		if a == LexerInput.LETTER:
+		if a is LexerInput.LETTER:
 			if b._is_char():
-				return _is_letter(b._get_char())
+				return b._kind == CharKind.LETTER
 			return False
 
-		if a == LexerInput.NON_LETTER:
+		if a is LexerInput.NON_LETTER:
 			if b._is_char():
-				return not _is_letter(b._get_char())
+				return b._kind != CharKind.LETTER
 			return True
 
-		if a == LexerInput.WHITESPACE:
+		if a is LexerInput.WHITESPACE:
 			if b._is_char():
-				return _is_whitespace(b._get_char())
+				return b._kind == CharKind.WHITESPACE
 
 		if a._is_char() and b._is_char():
-			return a == b
+			return a is b
 
 		# For comparing DEFAULT
 		raise NotImplementedError('Input comparison not implemented between {0} and {1}.'.format(str(a), str(b)))
@@ -113,6 +180,177 @@ LexerInput.LETTER = LexerInput._generate('A04letter')
 LexerInput.NON_LETTER = LexerInput._generate('A05non-letter')
 LexerInput.WHITESPACE = LexerInput._generate('A06whitespace')
 
+class CharSet:
+	# An immutable set of characters, made of disjoint intervals of code points. They are
+	# kept as the sorted boundaries where the set starts and stops, so a code point is in
+	# the set when an odd number of boundaries are not above it.
+
+	def __init__(self, intervals=()):
+		bounds = []
+		for first, last in sorted(intervals):
+			if len(bounds) > 0 and bounds[-1] >= first:
+				bounds[-1] = max(bounds[-1], last + 1)
+			else:
+				bounds.extend([first, last + 1])
+		self._set_bounds(bounds)
+
+	def __repr__(self):
+		def code_point(c):
+			return repr(chr(c)) if c < 0x80 else 'U+{0:04X}'.format(c)
+		intervals = self.intervals
+		return '{0}({1})'.format(self.__class__.__name__, ', '.join(
+			code_point(first) if first == last else '{0}-{1}'.format(code_point(first), code_point(last))
+			for first, last in intervals[:8]) + (', ...' if len(intervals) > 8 else ''))
+
+	def __eq__(self, other):
+		return isinstance(other, CharSet) and self._bounds == other._bounds
+
+	def __hash__(self):
+		return self._hash
+
+	def __lt__(self, other):
+		return self._bounds < other._bounds
+
+	def __bool__(self):
+		return len(self._bounds) > 0
+
+	def __contains__(self, char):
+		return bisect.bisect_right(self._bounds, ord(char)) % 2 == 1
+
+	def __or__(self, other):
+		return CharSet._intersection(self._complement(), other._complement())._complement()
+
+	def __and__(self, other):
+		return CharSet._intersection(self, other)
+
+	def __sub__(self, other):
+		return CharSet._intersection(self, other._complement())
+
+	@property
+	def intervals(self):
+		return tuple((self._bounds[i], self._bounds[i + 1] - 1) for i in range(0, len(self._bounds), 2))
+
+	def char(char):
+		return CharSet(((ord(char), ord(char)),))
+
+	def kind(kind):
+		if kind not in _kind_char_sets:
+			_kind_char_sets[kind] = CharSet((first, last) for first, last, k in char_kind_intervals() if k == kind)
+		return _kind_char_sets[kind]
+
+	def input(acceptor):
+		# The characters a LexerInput other than DEFAULT accepts.
+		if acceptor._is_char():
+			return CharSet.char(acceptor._get_char())
+
+		everything = CharSet(((0, _MAX_CODE_POINT),))
+		special = {
+			LexerInput.ANY        : lambda: everything,
+			LexerInput.DIGIT      : lambda: CharSet.kind(CharKind.DIGIT),
+			LexerInput.NON_DIGIT  : lambda: everything - CharSet.kind(CharKind.DIGIT),
+			LexerInput.LETTER     : lambda: CharSet.kind(CharKind.LETTER),
+			LexerInput.NON_LETTER : lambda: everything - CharSet.kind(CharKind.LETTER),
+			LexerInput.WHITESPACE : lambda: CharSet.kind(CharKind.WHITESPACE) }
+
+		if acceptor not in special:
+			raise NotImplementedError('Input {0} has no character set.'.format(str(acceptor)))
+		return special[acceptor]()
+
+	def _set_bounds(self, bounds):
+		self._bounds = tuple(bounds)
+		self._hash = hash(self._bounds)
+
+	def _bounded(bounds):
+		result = CharSet()
+		result._set_bounds(bounds)
+		return result
+
+	def _complement(self):
+		bounds = list(self._bounds)
+		if len(bounds) > 0 and bounds[0] == 0:
+			del bounds[0]
+		else:
+			bounds.insert(0, 0)
+		if len(bounds) > 0 and bounds[-1] == _MAX_CODE_POINT + 1:
+			del bounds[-1]
+		else:
+			bounds.append(_MAX_CODE_POINT + 1)
+		return CharSet._bounded(bounds)
+
+	def _intersection(a, b):
+		# Clips the larger set to every interval of the smaller one, so the cost is
+		# mostly in slicing.
+		if len(a._bounds) < len(b._bounds):
+			a, b = b, a
+		bounds = []
+		for index in range(0, len(b._bounds), 2):
+			first = b._bounds[index]
+			end = b._bounds[index + 1]
+			i = bisect.bisect_right(a._bounds, first)
+			j = bisect.bisect_left(a._bounds, end)
+			if i % 2 == 1:
+				bounds.append(first)
+			bounds.extend(a._bounds[i:j])
+			if j % 2 == 1:
+				bounds.append(end)
+		return CharSet._bounded(bounds)
+
+_kind_char_sets = {}
+
+def _candidate_chars(char_sets):
+	# Splits the code points at every boundary of the sets and of the character kinds.
+	# Within a kind, the spans that are in the same sets as most of the kind behave
+	# like any character of the kind; the characters of the other spans are literals.
+	# Returns a character of every kind that behaves like the kind, or None, and the
+	# sorted literals.
+
+	char_sets = list(set(char_sets))
+	kind_intervals = char_kind_intervals()
+	starts = set(first for first, last, kind in kind_intervals)
+	for char_set in char_sets:
+		for first, last in char_set.intervals:
+			starts.add(first)
+			if last < _MAX_CODE_POINT:
+				starts.add(last + 1)
+	starts = sorted(starts)
+	positions = dict((start, index) for index, start in enumerate(starts))
+
+	signatures = [0] * len(starts)
+	for bit, char_set in enumerate(char_sets):
+		for first, last in char_set.intervals:
+			end = positions[last + 1] if last < _MAX_CODE_POINT else len(starts)
+			for index in range(positions[first], end):
+				signatures[index] = signatures[index] | (1 << bit)
+
+	kinds = []
+	kind_index = 0
+	for index, start in enumerate(starts):
+		while kind_intervals[kind_index][1] < start:
+			kind_index = kind_index + 1
+		kinds.append(kind_intervals[kind_index][2])
+
+	sizes = {}
+	for index, start in enumerate(starts):
+		end = starts[index + 1] if index + 1 < len(starts) else _MAX_CODE_POINT + 1
+		key = (kinds[index], signatures[index])
+		sizes[key] = sizes.get(key, 0) + end - start
+
+	common = {}
+	for (kind, signature), size in sizes.items():
+		if kind not in common or size > sizes[(kind, common[kind])]:
+			common[kind] = signature
+
+	representatives = [None] * CharKind.COUNT
+	literals = []
+	for index, start in enumerate(starts):
+		end = starts[index + 1] if index + 1 < len(starts) else _MAX_CODE_POINT + 1
+		if signatures[index] == common[kinds[index]]:
+			if representatives[kinds[index]] is None:
+				representatives[kinds[index]] = chr(start)
+		else:
+			literals.extend(chr(c) for c in range(start, end))
+	return representatives, literals
+
 class NFAGraph:
 	def __init__(self):
 		self._states = []
@@ -284,8 +522,22 @@ class DFAState:
 		self._moves.append((acceptor, state))
 
 class NFAGraphGenerator:
+	# Fragments are compiled once into a template: the moves of their states, numbered
+	# from the state they start at. Every reference copies the template, creating its
+	# states in the same order as expanding the fragment grammar would.
+
+	def __init__(self):
+		self._templates = {}
+		self._copied_state_count = 0
+
+	@property
+	def copied_state_count(self):
+		return self._copied_state_count
+
 	def generate(self, context):
 		states = []
+		self._templates = {}
+		self._copied_state_count = 0
 		start_state = self.create_state(states)
 
 		for key, rule in context.rules.items():
@@ -339,13 +591,39 @@ class NFAGraphGenerator:
 			current_state = end_state
 
 		elif isinstance(grammar, GrammarReference):
-			current_state = self.iterate(current_state, states, rules[grammar.identifier].grammar, rules)
+			current_state = self.instantiate(current_state, states, self.template(grammar.identifier, rules))
 
 		else:
 			raise NotImplementedError('The {0} expression has no implementation.'.format(grammar.__class__.__name__))
 
 		return current_state
 
+	def template(self, identifier, rules):
+		# The moves of every state of the fragment as (input, target) pairs of offsets,
+		# and the offset of its last state. The offset 0 is the state it starts at.
+		if identifier not in self._templates:
+			copied_state_count = self._copied_state_count
+			template_states = []
+			first_state = self.create_state(template_states)
+			last_state = self.iterate(first_state, template_states, rules[identifier].grammar, rules)
+			self._copied_state_count = copied_state_count
+			self._templates[identifier] = (
+				[[(i, t.index) for i, t in s.moves] for s in template_states],
+				last_state.index)
+		return self._templates[identifier]
+
+	def instantiate(self, current_state, states, template):
+		moves, last_offset = template
+		copies = [current_state]
+		for _ in moves[1:]:
+			copies.append(self.create_state(states))
+		self._copied_state_count = self._copied_state_count + len(moves) - 1
+
+		for state, state_moves in zip(copies, moves):
+			for i, target in state_moves:
+				state.consume(i, copies[target])
+		return copies[last_offset]
+
 	def create_state(self, states):
 		state = NFAState()
 		state.index = len(states)
@@ -353,24 +631,37 @@ class NFAGraphGenerator:
 		return state
 
 class DFAGraphGenerator:
+	# Builds a DFA by subset construction. The moves of a DFA state are on disjoint
+	# character sets: the inputs of the NFA states are split into the pieces that are
+	# accepted by the same inputs, and pieces moving to the same states are joined.
+
+	def __init__(self):
+		self._closures = {}
+		self._indexed_moves = {}
+		self._char_sets = {}
+		self._pieces = {}
+		self._unions = {}
+
 	def generate(self, nfa_graph):
 		states = []
 		visited = {}
 		nodes = []
 
+		self._closures = self.epsilon_closures(nfa_graph)
+		self._indexed_moves = self.index_moves(nfa_graph)
+
 		node = frozenset(self.default_closure([nfa_graph.states[0]]))
 		nodes.append(node)
 		visited[node] = self.create_state(states)
-		visited[node].rules = [r.rule for r in node if r.rule != None]
+		visited[node].rules = self.accepted_rules(node)
 
 		index = 0
 		while index < len(nodes):
-			for i in self.get_inputs(nodes[index]):
-				node = frozenset(self.input_closure(nodes[index], i))
+			for i, node in self.successors(nodes[index]):
 				if node not in visited:
 					nodes.append(node)
 					visited[node] = self.create_state(states)
-					visited[node].rules = [r.rule for r in node if r.rule != None]
+					visited[node].rules = self.accepted_rules(node)
 
 				visited[nodes[index]].consume(i, visited[node])
 			index = index + 1
@@ -379,25 +670,146 @@ class DFAGraphGenerator:
 		dfa_graph.states = states
 		return dfa_graph
 
-	def default_closure(self, nfa_states):
-		visited = set(nfa_states)
+	def accepted_rules(self, nfa_states):
+		# The states of every rule are created after the ones of the rules declared
+		# before it, so sorting by index lists the rules in declaration order.
+		return [s.rule for s in sorted(nfa_states, key=lambda s: s.index) if s.rule != None]
+
+	def epsilon_closures(self, nfa_graph):
+		# Maps the index of every NFA state to the states it reaches by DEFAULT moves.
+		# States of a strongly connected component share their closure, which is the
+		# component along with the closures of the components it moves to. Tarjan's
+		# algorithm finds the components after the ones they move to, so these closures
+		# are always known by then.
+
+		successors = dict(
+			(s.index, [t for i, t in s.moves if i is LexerInput.DEFAULT])
+			for s in nfa_graph.states)
+
+		closures = {}
+		numbers = {}
+		lowlinks = {}
+		stack = []
+		on_stack = set()
+
+		for root in nfa_graph.states:
+			if root.index in numbers:
+				continue
+
+			numbers[root.index] = lowlinks[root.index] = len(numbers)
+			stack.append(root)
+			on_stack.add(root.index)
+			path = [(root, iter(successors[root.index]))]
+
+			while len(path) > 0:
+				u, targets = path[-1]
+				v = next(targets, None)
+				if v is not None:
+					if v.index not in numbers:
+						numbers[v.index] = lowlinks[v.index] = len(numbers)
+						stack.append(v)
+						on_stack.add(v.index)
+						path.append((v, iter(successors[v.index])))
+					elif v.index in on_stack:
+						lowlinks[u.index] = min(lowlinks[u.index], numbers[v.index])
+					continue
+
+				path.pop()
+				if len(path) > 0:
+					parent = path[-1][0]
+					lowlinks[parent.index] = min(lowlinks[parent.index], lowlinks[u.index])
+
+				if lowlinks[u.index] == numbers[u.index]:
+					component = []
+					while True:
+						w = stack.pop()
+						on_stack.discard(w.index)
+						component.append(w)
+						if w is u:
+							break
+
+					closure = set(component)
+					for w in component:
+						for t in successors[w.index]:
+							if t.index in closures:
+								closure.update(closures[t.index])
+					closure = frozenset(closure)
+					for w in component:
+						closures[w.index] = closure
+
+		return closures
 
-		queue = list(nfa_states)
-		index = 0
-		while index < len(queue):
-			for s in [t for i, t in queue[index].moves if i == LexerInput.DEFAULT]:
-				if s not in visited:
-					queue.append(s)
-			index = index + 1
-
-		return queue
-
-	def input_closure(self, nfa_states, input_):
-		closure = [t for s in nfa_states for i, t in s.moves if i != LexerInput.DEFAULT and LexerInput.match(i, input_)]
-		return self.default_closure(closure)
-
-	def get_inputs(self, nfa_states):
-		return sorted(set([i for s in nfa_states for i, t in s.moves if i != LexerInput.DEFAULT]))
+	def default_closure(self, nfa_states):
+		if len(nfa_states) == 1:
+			return self._closures[nfa_states[0].index]
+		return frozenset().union(*[self._closures[s.index] for s in nfa_states])
+
+	def index_moves(self, nfa_graph):
+		# Maps the index of every NFA state to its targets grouped by input, without the
+		# DEFAULT moves.
+		indexed_moves = {}
+		for s in nfa_graph.states:
+			moves = {}
+			for i, t in s.moves:
+				if i is not LexerInput.DEFAULT:
+					moves.setdefault(i, []).append(t)
+			indexed_moves[s.index] = moves
+		return indexed_moves
+
+	def successors(self, nfa_states):
+		# The (character set, closure) pairs of the moves of a set of NFA states, ordered
+		# by character set. The targets of the set are grouped by input in one pass, and
+		# every piece of the inputs moves to the closure of the targets of the inputs
+		# accepting it.
+		targets = {}
+		for s in nfa_states:
+			for i, ts in self._indexed_moves[s.index].items():
+				targets.setdefault(i, []).extend(ts)
+
+		inputs = tuple(sorted(targets))
+		closures = {}
+		for piece, members in self.split_inputs(inputs):
+			closure = self.default_closure([t for n in members for t in targets[inputs[n]]])
+			closures.setdefault(closure, []).append(piece)
+
+		return sorted((self.union(pieces), closure) for closure, pieces in closures.items())
+
+	def split_inputs(self, inputs):
+		# The disjoint pieces of a tuple of inputs, with the positions of the inputs
+		# accepting each of them. Subsets often share their inputs, so pieces are cached.
+		if inputs not in self._pieces:
+			pieces = []
+			for n, i in enumerate(inputs):
+				if i not in self._char_sets:
+					self._char_sets[i] = CharSet.input(i)
+				rest = self._char_sets[i]
+
+				split = []
+				for piece, members in pieces:
+					common = piece & rest if rest else rest
+					if common:
+						split.append((common, members + (n,)))
+						if common != piece:
+							split.append((piece - common, members))
+						rest = rest - common
+					else:
+						split.append((piece, members))
+				if rest:
+					split.append((rest, (n,)))
+				pieces = split
+			self._pieces[inputs] = pieces
+		return self._pieces[inputs]
+
+	def union(self, char_sets):
+		if len(char_sets) == 1:
+			return char_sets[0]
+		key = tuple(char_sets)
+		if key not in self._unions:
+			union = char_sets[0]
+			for char_set in char_sets[1:]:
+				union = union | char_set
+			self._unions[key] = union
+		return self._unions[key]
 
 	def create_state(self, states):
 		state = DFAState()
@@ -405,14 +817,108 @@ class DFAGraphGenerator:
 		states.append(state)
 		return state
 
+class DFAMinimizer:
+	# Merges equivalent DFA states by Hopcroft's partition refinement (Hopcroft, An n log n
+	# algorithm for minimizing states in a finite automaton, 1971). States start split by
+	# the set of rules they accept, so accepting states of different rules stay apart.
+	#
+	# The alphabet is the literal characters and the kinds of the other characters, like
+	# in the transition table, and every merged state keeps the moves of its first
+	# state, redirected to the merged states.
+
+	def minimize(self, dfa_graph):
+		states = dfa_graph.states
+		if len(states) == 0:
+			return DFAGraph()
+
+		representatives, literals = _candidate_chars([a for s in states for a, t in s.moves])
+		candidates = [c for c in representatives if c is not None] + literals
+		positions = dict((s.index, p) for p, s in enumerate(states))
+
+		# The states moving to each state on each candidate.
+		predecessors = [dict() for c in candidates]
+		for s in states:
+			for c, candidate in enumerate(candidates):
+				target = self.follow(s, candidate)
+				if target is not None:
+					predecessors[c].setdefault(positions[target.index], []).append(positions[s.index])
+
+		blocks = {}
+		for p, s in enumerate(states):
+			blocks.setdefault(frozenset(s.rules), set()).add(p)
+		partition = list(blocks.values())
+		block_of = [0] * len(states)
+		for b, block in enumerate(partition):
+			for p in block:
+				block_of[p] = b
+
+		pending = set(range(len(partition)))
+		while len(pending) > 0:
+			splitter = list(partition[pending.pop()])
+			for c in range(len(candidates)):
+				movers = {}
+				for p in splitter:
+					for q in predecessors[c].get(p, []):
+						movers.setdefault(block_of[q], set()).add(q)
+
+				for b, moved in movers.items():
+					if len(moved) == len(partition[b]):
+						continue
+
+					partition[b] = partition[b] - moved
+					partition.append(moved)
+					for q in moved:
+						block_of[q] = len(partition) - 1
+
+					if b in pending or len(moved) <= len(partition[b]):
+						pending.add(len(partition) - 1)
+					else:
+						pending.add(b)
+
+		# Merged states are numbered by their first state, so the start state stays first.
+		order = sorted(range(len(partition)), key=lambda b: min(partition[b]))
+		minimized = []
+		for b in order:
+			state = DFAState()
+			state.index = len(minimized)
+			state.rules = list(states[min(partition[b])].rules)
+			minimized.append(state)
+		merged = dict((b, minimized[index]) for index, b in enumerate(order))
+
+		for b in order:
+			for a, t in states[min(partition[b])].moves:
+				merged[b].consume(a, merged[block_of[positions[t.index]]])
+
+		dfa_graph = DFAGraph()
+		dfa_graph.states = minimized
+		return dfa_graph
+
+	def follow(self, state, char):
+		for a, t in state.moves:
+			if char in a:
+				return t
+		return None
+
 class TransitionTableState:
 	def __init__(self):
+		self._index = None
 		self._fallbacks = []
 		self._rules = []
+		self._alphabet = None
+		self._row = []
+		self._skip = None
 
 	def __repr__(self):
 		return '{0} {1}'.format(self.__class__.__name__, str(self.__dict__))
 
+	@property
+	def index(self):
+		return self._index
+
+	@index.setter
+	def index(self, value):
+		self._index = value
+
 	@property
 	def rules(self):
 	    return self._rules
@@ -420,19 +926,151 @@ class TransitionTableState:
 	@rules.setter
 	def rules(self, value):
 	    self._rules = value
-	
+
+	@property
+	def skip(self):
+		# A pattern matching the run of characters the state loops on, or None.
+		return self._skip
+
+	@skip.setter
+	def skip(self, value):
+		self._skip = value
+
 	def on(self, char):
+		return self._row[self._alphabet.classify(char)]
+
+	def fallback(self, acceptor, state):
+		self._fallbacks.append((acceptor, state))
+
+	def follow(self, char):
+		# Resolves the fallback whose character set holds the character.
+
 		for a, s in self._fallbacks:
-			if LexerInput.match(a, LexerInput.char(char)):
+			if char in a:
 				return s
 		return None
 
-	def fallback(self, acceptor, state):
-		self._fallbacks.append((acceptor, state))
+	def compile(self, alphabet, row):
+		self._alphabet = alphabet
+		self._row = row
+
+class _CharClasses(dict):
+	# Literal characters map to their own class, any other character to the class of its kind.
+	# ASCII characters are stored up front; others are classified on every lookup, which
+	# is cached by _char_kind(), so that the dictionary does not grow with the text.
+
+	def __init__(self, char_classes, kind_classes):
+		dict.__init__(self, char_classes)
+		self._kind_classes = kind_classes
+		for c in range(128):
+			self.setdefault(chr(c), kind_classes[_ASCII_KINDS[c]])
+
+	def __missing__(self, char):
+		return self._kind_classes[_char_kind(char)]
+
+class TransitionTableAlphabet:
+	def __init__(self, char_classes, kind_classes, class_count):
+		self._char_classes = char_classes
+		self._kind_classes = kind_classes
+		self._class_count = class_count
+		self._classes = _CharClasses(char_classes, kind_classes)
+		self._class_runs = None
+
+	def __repr__(self):
+		return '{0} {1}'.format(self.__class__.__name__, str(self.__dict__))
+
+	@property
+	def char_classes(self):
+		return self._char_classes
+
+	@property
+	def kind_classes(self):
+		return self._kind_classes
+
+	@property
+	def class_count(self):
+		return self._class_count
+
+	@property
+	def classes(self):
+		return self._classes
+
+	def classify(self, char):
+		return self._classes[char]
+
+	def class_runs(self):
+		# Runs of consecutive code points of the same class, as (first, last, class)
+		# tuples: the runs of character kinds, split by the literals.
+		if self._class_runs is None:
+			kinds = dict((first, self._kind_classes[kind]) for first, last, kind in char_kind_intervals())
+			kind_starts = sorted(kinds)
+
+			starts = dict(kinds)
+			literals = [ord(c) for c in self._char_classes]
+			for code_point in literals:
+				if code_point < _MAX_CODE_POINT:
+					starts[code_point + 1] = kinds[kind_starts[bisect.bisect_right(kind_starts, code_point + 1) - 1]]
+			for code_point in literals:
+				starts[code_point] = self._char_classes[chr(code_point)]
+
+			runs = []
+			for first in sorted(starts):
+				if len(runs) > 0 and runs[-1][2] == starts[first]:
+					continue
+				if len(runs) > 0:
+					runs[-1] = (runs[-1][0], first - 1, runs[-1][2])
+				runs.append((first, _MAX_CODE_POINT, starts[first]))
+			self._class_runs = runs
+		return self._class_runs
+
+	def run_pattern(self, classes):
+		# A regular expression matching a run of characters of the given classes.
+		ranges = ''.join(
+			'\\U{0:08x}-\\U{1:08x}'.format(first, last)
+			for first, last, cls in self.class_runs() if cls in classes)
+		return re.compile('[{0}]*'.format(ranges))
+
+	def code_point_classes(self):
+		classes = array('i', [0]) * (_MAX_CODE_POINT + 1)
+		for first, last, kind in char_kind_intervals():
+			classes[first:last + 1] = array('i', [self._kind_classes[kind]]) * (last - first + 1)
+		for char, cls in self._char_classes.items():
+			classes[ord(char)] = cls
+		return classes
+
+class ByteTransitionTableAlphabet:
+	def __init__(self, classes, class_count):
+		self._classes = classes
+		self._class_count = class_count
+
+	def __repr__(self):
+		return '{0} {1}'.format(self.__class__.__name__, str(self.__dict__))
+
+	@property
+	def class_count(self):
+		return self._class_count
+
+	@property
+	def classes(self):
+		return self._classes
+
+	def classify(self, byte):
+		return self._classes[byte]
+
+	def run_pattern(self, classes):
+		# A regular expression matching a run of bytes of the given classes.
+		ranges = ''.join('\\x{0:02x}'.format(byte) for byte, cls in enumerate(self._classes) if cls in classes)
+		return re.compile('[{0}]*'.format(ranges).encode('ascii'))
 
 class TransitionTable:
+	NO_MOVE = -1
+
 	def __init__(self):
 		self._states = []
+		self._rules = []
+		self._channels = {}
+		self._alphabet = None
+		self._transitions = []
 
 	def __repr__(self):
 		return '{0} {1}'.format(self.__class__.__name__, str(self.__dict__))
@@ -441,67 +1079,1207 @@ class TransitionTable:
 	def states(self):
 		return self._states
 
+	@property
+	def rules(self):
+		return self._rules
+
+	@rules.setter
+	def rules(self, value):
+		self._rules = value
+
+	@property
+	def channels(self):
+		return self._channels
+
+	@channels.setter
+	def channels(self, value):
+		self._channels = value
+
+	@property
+	def alphabet(self):
+		return self._alphabet
+
+	@alphabet.setter
+	def alphabet(self, value):
+		self._alphabet = value
+
+	@property
+	def transitions(self):
+		return self._transitions
+
+	@transitions.setter
+	def transitions(self, value):
+		self._transitions = value
+
+	def link_states(self):
+		# States that move to themselves on some classes get a pattern to skip over the
+		# runs of these classes at once.
+		class_count = self._alphabet.class_count
+		for s in self._states:
+			row = self._transitions[s.index * class_count:(s.index + 1) * class_count]
+			s.compile(self._alphabet, [self._states[t] if t != TransitionTable.NO_MOVE else None for t in row])
+			loops = set(c for c, t in enumerate(row) if t == s.index)
+			s.skip = self._alphabet.run_pattern(loops) if len(loops) > 0 else None
+
 class TransitionTableGenerator:
-	def generate(self, dfa_graph):
+	def generate(self, dfa_graph, rules=None, channels=None):
+		# A state accepting several rules only accepts the one with the highest priority,
+		# so every token is emitted once. The rules are given in order of priority, such
+		# as their declaration order; by default, the order of the rules listed by the
+		# DFA states is kept, which is the declaration order. The channels map rules to
+		# their TokenChannels value, which is DEFAULT when missing.
+
 		table = TransitionTable()
+		table.channels = dict(channels) if channels is not None else {}
+
+		table.rules = list(rules) if rules is not None else self.rule_order(dfa_graph)
+		table.rules.extend(r for r in self.rule_order(dfa_graph) if r not in table.rules)
+		priorities = dict((r, index) for index, r in enumerate(table.rules))
 
 		table_states = {}	
 		for u in dfa_graph.states:
 			table_states[u.index] = TransitionTableState()
-			table_states[u.index].rules = u.rules
+			table_states[u.index].index = len(table.states)
+			if len(u.rules) > 0:
+				table_states[u.index].rules = [min(u.rules, key=priorities.get)]
 			table.states.append(table_states[u.index])
 
 		for u in dfa_graph.states:
 			for a, v in u.moves:
 				table_states[u.index].fallback(a, table_states[v.index])
 
+		self.compile(table)
 		return table
 
+	def rule_order(self, dfa_graph):
+		# Merges the rule lists of the states into a single order that keeps all of them.
+		successors = {}
+		predecessor_counts = {}
+		for u in dfa_graph.states:
+			for index, r in enumerate(u.rules):
+				successors.setdefault(r, set())
+				predecessor_counts.setdefault(r, 0)
+				if index > 0 and r not in successors[u.rules[index - 1]]:
+					successors[u.rules[index - 1]].add(r)
+					predecessor_counts[r] = predecessor_counts[r] + 1
+
+		order = []
+		ready = deque(r for r in successors if predecessor_counts[r] == 0)
+		while len(ready) > 0:
+			r = ready.popleft()
+			order.append(r)
+			for t in sorted(successors[r]):
+				predecessor_counts[t] = predecessor_counts[t] - 1
+				if predecessor_counts[t] == 0:
+					ready.append(t)
+
+		# Only hand-made graphs may list the rules in inconsistent orders.
+		order.extend(r for r in successors if r not in order)
+		return order
+
+	def compile(self, table):
+		# Every literal character and every kind of non-literal character is a candidate
+		# class. Candidates whose moves are the same in every state are merged, so the
+		# resulting table has a column per equivalence class.
+
+		representatives, literals = _candidate_chars([a for s in table.states for a, t in s._fallbacks])
+		candidates = representatives + literals
+
+		columns = {}
+		candidate_classes = []
+		for candidate in candidates:
+			# A kind whose characters are all literals is never looked up.
+			if candidate is None:
+				candidate = next(c for c in representatives if c is not None)
+			column = tuple(self.target_index(s.follow(candidate)) for s in table.states)
+			if column not in columns:
+				columns[column] = len(columns)
+			candidate_classes.append(columns[column])
+
+		kind_classes = candidate_classes[:CharKind.COUNT]
+		char_classes = dict(zip(literals, candidate_classes[CharKind.COUNT:]))
+		table.alphabet = TransitionTableAlphabet(char_classes, kind_classes, len(columns))
+
+		class_count = table.alphabet.class_count
+		transitions = [TransitionTable.NO_MOVE] * (len(table.states) * class_count)
+		for column, cls in columns.items():
+			for index, target in enumerate(column):
+				transitions[index * class_count + cls] = target
+		table.transitions = transitions
+		table.link_states()
+
+	def target_index(self, state):
+		return state.index if state is not None else TransitionTable.NO_MOVE
+
+class ByteTransitionTableGenerator:
+	# Compiles a transition table over characters into one over UTF-8 bytes, so input can
+	# be lexed from bytes, bytearray, memoryview or mmap objects without decoding it, and
+	# offsets are byte offsets. The states of the character table keep their indexes;
+	# multi-byte sequences go through intermediate states, which are shared between all
+	# the states and code point blocks that behave the same way.
+	#
+	# The continuation byte of a sequence selects a code point in a block of 64, the
+	# previous one a block in a superblock of 4096 code points, and the one before it a
+	# superblock in a hyperblock of 262144 code points.
+
+	def generate(self, transition_table):
+		n = len(transition_table.states)
+		char_class_count = transition_table.alphabet.class_count
+		char_transitions = transition_table.transitions
+
+		code_point_classes = transition_table.alphabet.code_point_classes()
+		patterns = {}
+		block_patterns = []
+		for block in range((_MAX_CODE_POINT + 1) >> 6):
+			key = code_point_classes[block << 6:(block + 1) << 6].tobytes()
+			if key not in patterns:
+				patterns[key] = len(patterns)
+			block_patterns.append(patterns[key])
+		pattern_classes = [array('i', key) for key in patterns]
+
+		rows = [None] * n
+		nodes = {}
+
+		def intern(targets):
+			# Intermediate states only move on continuation bytes.
+			if all(t == TransitionTable.NO_MOVE for t in targets):
+				return TransitionTable.NO_MOVE
+			key = tuple(targets)
+			if key not in nodes:
+				nodes[key] = len(rows)
+				rows.append([TransitionTable.NO_MOVE] * 0x80 + list(key) + [TransitionTable.NO_MOVE] * 0x40)
+			return nodes[key]
+
+		for u in range(n):
+			char_row = char_transitions[u * char_class_count:(u + 1) * char_class_count]
+
+			pattern_nodes = [intern([char_row[c] for c in classes]) for classes in pattern_classes]
+			blocks = [pattern_nodes[p] for p in block_patterns]
+
+			superblocks = []
+			for superblock in range(len(blocks) >> 6):
+				targets = blocks[superblock << 6:(superblock + 1) << 6]
+				if superblock == 0x00:
+					# Overlong encodings of code points below 0x800.
+					targets = [TransitionTable.NO_MOVE] * 0x20 + targets[0x20:]
+				elif superblock == 0x0D:
+					# Surrogates.
+					targets = targets[:0x20] + [TransitionTable.NO_MOVE] * 0x20
+				superblocks.append(intern(targets))
+			superblocks.extend([TransitionTable.NO_MOVE] * (0x140 - len(superblocks)))
+
+			hyperblocks = []
+			for hyperblock in range(5):
+				targets = superblocks[hyperblock << 6:(hyperblock + 1) << 6]
+				if hyperblock == 0:
+					# Overlong encodings of code points below 0x10000.
+					targets = [TransitionTable.NO_MOVE] * 0x10 + targets[0x10:]
+				hyperblocks.append(intern(targets))
+
+			row = [TransitionTable.NO_MOVE] * 0x100
+			for byte in range(0x80):
+				row[byte] = char_row[code_point_classes[byte]]
+			for byte in range(0xC2, 0xE0):
+				row[byte] = blocks[byte & 0x1F]
+			for byte in range(0xE0, 0xF0):
+				row[byte] = superblocks[byte & 0x0F]
+			for byte in range(0xF0, 0xF5):
+				row[byte] = hyperblocks[byte & 0x07]
+			rows[u] = row
+
+		columns = {}
+		classes = []
+		for byte in range(0x100):
+			column = tuple(row[byte] for row in rows)
+			if column not in columns:
+				columns[column] = len(columns)
+			classes.append(columns[column])
+
+		table = TransitionTable()
+		table.rules = transition_table.rules
+		table.channels = transition_table.channels
+		for index in range(len(rows)):
+			state = TransitionTableState()
+			state.index = index
+			if index < n:
+				state.rules = transition_table.states[index].rules
+			table.states.append(state)
+
+		table.alphabet = ByteTransitionTableAlphabet(classes, len(columns))
+
+		class_count = table.alphabet.class_count
+		transitions = [TransitionTable.NO_MOVE] * (len(rows) * class_count)
+		for column, cls in columns.items():
+			for index, target in enumerate(column):
+				transitions[index * class_count + cls] = target
+		table.transitions = transitions
+		table.link_states()
+		return table
+
+class _EndOfSlice(Exception):
+	pass
+
+def _slice_chunks(text, last):
+	yield text
+	if not last:
+		raise _EndOfSlice()
+
+_worker_arrays = None
+_worker_traverser = None
+
+def _initialize_worker(arrays, traverser):
+	global _worker_arrays, _worker_traverser
+	_worker_arrays = arrays
+	_worker_traverser = traverser
+
+def _traverse_batch(task):
+	rules, texts, start = task
+	return _worker_traverser._batch(_worker_arrays, rules, texts, start)
+
+def _speculate(task):
+	# Lexes a slice of the input from the start state, as if a token started at its first
+	# character. Only tokens finalized inside the slice are kept: a failure or the end of
+	# the slice just stop the speculation.
+
+	text, base, last = task
+	tokens = []
+	try:
+		for offset, length, rule in _worker_traverser._tokens(_worker_arrays, _slice_chunks(text, last)):
+			tokens.append((base + offset, length, rule))
+	except (LexerError, _EndOfSlice):
+		pass
+	return tokens
+
+class TokenArrays:
+	# Tokens stored column-wise in compact arrays, with the rules as indexes into a table
+	# of rule names. Indexing or iterating builds (offset, length, rule) tuples on demand.
+
+	def __init__(self, rules):
+		self._rules = list(rules)
+		self._offsets = array('q')
+		self._lengths = array('q')
+		self._rule_ids = array('i')
+
+	def __repr__(self):
+		return '{0} {1}'.format(self.__class__.__name__, str(self.__dict__))
+
+	def __len__(self):
+		return len(self._offsets)
+
+	def __getitem__(self, index):
+		if isinstance(index, slice):
+			return [self[i] for i in range(*index.indices(len(self)))]
+		return (self._offsets[index], self._lengths[index], self._rules[self._rule_ids[index]])
+
+	def __iter__(self):
+		rules = self._rules
+		for offset, length, rule_id in zip(self._offsets, self._lengths, self._rule_ids):
+			yield (offset, length, rules[rule_id])
+
+	def __eq__(self, other):
+		return list(self) == list(other)
+
+	@property
+	def rules(self):
+		return self._rules
+
+	@property
+	def offsets(self):
+		return self._offsets
+
+	@property
+	def lengths(self):
+		return self._lengths
+
+	@property
+	def rule_ids(self):
+		return self._rule_ids
+
+	def append(self, offset, length, rule_id):
+		self._offsets.append(offset)
+		self._lengths.append(length)
+		self._rule_ids.append(rule_id)
+
+	def to_numpy(self):
+		# The NumPy arrays share the memory of the arrays, so nothing is copied.
+		import numpy
+		return (
+			numpy.frombuffer(self._offsets, dtype=numpy.int64),
+			numpy.frombuffer(self._lengths, dtype=numpy.int64),
+			numpy.frombuffer(self._rule_ids, dtype=numpy.int32))
+
+class TokenBatch(TokenArrays):
+	# The tokens of a batch of strings, one string after another. The tokens of the
+	# string at an index are the ones from starts[index] to starts[index + 1], and their
+	# offsets are relative to the string.
+
+	def __init__(self, rules):
+		super().__init__(rules)
+		self._starts = array('q', [0])
+
+	@property
+	def starts(self):
+		return self._starts
+
+	def string_count(self):
+		return len(self._starts) - 1
+
+	def string_tokens(self, index):
+		return self[self._starts[index]:self._starts[index + 1]]
+
+	def extend(self, other):
+		base = len(self)
+		self._offsets.extend(other.offsets)
+		self._lengths.extend(other.lengths)
+		self._rule_ids.extend(other.rule_ids)
+		self._starts.extend(base + start for start in other.starts[1:])
+
+class LineIndex:
+	# The offsets where the lines of a text start, to find the line and column of an
+	# offset with a binary search. The text can be added in chunks, as it's read. Lines
+	# and columns start at 1; for bytes, columns count bytes.
+
+	def __init__(self, text=None):
+		self._line_starts = array('q', [0])
+		self._length = 0
+		if text is not None:
+			self.add_text(text)
+
+	def __repr__(self):
+		return '{0} {1}'.format(self.__class__.__name__, str(self.__dict__))
+
+	@property
+	def line_starts(self):
+		return self._line_starts
+
+	@property
+	def length(self):
+		return self._length
+
+	def line_count(self):
+		return len(self._line_starts)
+
+	def add_text(self, text):
+		if isinstance(text, memoryview):
+			text = text.tobytes()
+		newline = '\n' if isinstance(text, str) else b'\n'
+
+		append = self._line_starts.append
+		index = text.find(newline)
+		while index != -1:
+			append(self._length + index + 1)
+			index = text.find(newline, index + 1)
+		self._length = self._length + len(text)
+
+	def position(self, offset):
+		line = bisect.bisect_right(self._line_starts, offset)
+		return line, offset - self._line_starts[line - 1] + 1
+
+	def positions(self, offsets):
+		# Returns the lines and the columns of many offsets, such as TokenArrays.offsets,
+		# as arrays. NumPy arrays are searched all at once.
+		if hasattr(offsets, 'dtype'):
+			import numpy
+			line_starts = numpy.frombuffer(self._line_starts, dtype=numpy.int64)
+			lines = numpy.searchsorted(line_starts, offsets, side='right')
+			return lines, offsets - line_starts[lines - 1] + 1
+
+		line_starts = self._line_starts
+		search = bisect.bisect_right
+		lines = array('q', [search(line_starts, offset) for offset in offsets])
+		columns = array('q', [offset - line_starts[line - 1] + 1 for offset, line in zip(offsets, lines)])
+		return lines, columns
+
+class TokenMatch:
+	def __init__(self, offset, length, rule, string):
+		self._offset = offset
+		self._length = length
+		self._rule = rule
+		self._string = string
+
+	def __repr__(self):
+		return '{0} {1}'.format(self.__class__.__name__, str(self.__dict__))
+
+	@property
+	def offset(self):
+		return self._offset
+
+	@property
+	def length(self):
+		return self._length
+
+	@property
+	def rule(self):
+		return self._rule
+
+	@property
+	def string(self):
+		return self._string
+
+class AbstractTokenListener:
+	# Receives the tokens from TransitionTableTraverser.process(). For every token,
+	# before_token() is called first, then visit_<Rule>() if the listener defines it for
+	# the rule of the token, and after_token() last.
+
+	def before_token(self, info):
+		pass
+
+	def after_token(self, info):
+		pass
+
+class _TableArrays:
+	# The parts of a transition table the traversers read in their loops, as plain lists
+	# indexed by state, with the rules of the states filtered by channel. It's sent to
+	# the worker processes as it is.
+
+	def __init__(self, transitions, class_count, classes, accepting, state_rules, startable, error_rule, skips):
+		self.transitions = transitions
+		self.class_count = class_count
+		self.classes = classes
+		self.accepting = accepting
+		self.state_rules = state_rules
+		self.startable = startable
+		self.error_rule = error_rule
+		self.skips = skips
+
+	def munch(self, text, start):
+		# Scans the longest token at the start. Returns its accepting state, or -1 if
+		# there's none, the index of its end, and the index where the scan stopped.
+		transitions = self.transitions
+		class_count = self.class_count
+		classes = self.classes
+		accepting = self.accepting
+		skips = self.skips
+
+		text_length = len(text)
+		state = 0
+		index = start
+		accept_state = -1
+		accept_index = start
+		while index < text_length:
+			state = transitions[state * class_count + classes[text[index]]]
+			if state == TransitionTable.NO_MOVE:
+				break
+			index = index + 1
+			if skips[state] is not None:
+				index = skips[state].match(text, index).end()
+			if accepting[state]:
+				accept_state = state
+				accept_index = index
+		return accept_state, accept_index, index
+
+	def for_classes(self):
+		# The arrays to scan a sequence of class ids instead of the text: every id is its
+		# own class, and there are no characters for the skip patterns to match.
+		return _TableArrays(
+			self.transitions,
+			self.class_count,
+			list(range(self.class_count)),
+			self.accepting,
+			self.state_rules,
+			self.startable,
+			self.error_rule,
+			[None] * len(self.skips))
+
+	def failure(self, text, index):
+		# The error of a scan that stopped at the index without any accepting state.
+		if index == len(text):
+			return LexerError('End of file found without any matching rule.')
+		return LexerError('Failed to match \'{0}\' character'.format(text[index]))
+
 class TransitionTableTraverser:
-	def traverse(self, transition_table, text):
-		start_state = transition_table.states[0]
-		current_state = start_state
+	CHUNK_SIZE = 64 * 1024
+	PARALLEL_CHUNK_SIZE = 1024 * 1024
+	ERROR_RULE = '<error>'
+
+	def __init__(self, linear=False, hidden=False, recover=False):
+		# In linear mode, the (state, position) pairs visited after the last accepting
+		# state of a failed scan are remembered, and later scans stop as soon as they
+		# reach one of them, so maximal munch never rescans the same text in the same
+		# state (Reps, "Maximal-munch" tokenization in linear time, 1998).
+		#
+		# Tokens of skipped rules are never emitted, and tokens of hidden rules are only
+		# emitted when hidden is set.
+		#
+		# In recovery mode, text that can't be matched doesn't raise a LexerError: it's
+		# emitted as an ERROR_RULE token, which spans up to the next character some rule
+		# can start with, and lexing goes on from there. The number of error tokens of
+		# the last traversal is kept in error_count.
+		self._linear = linear
+		self._hidden = hidden
+		self._recover = recover
+		self._error_count = 0
+
+	@property
+	def linear(self):
+		return self._linear
+
+	@property
+	def hidden(self):
+		return self._hidden
+
+	@property
+	def recover(self):
+		return self._recover
+
+	@property
+	def error_count(self):
+		return self._error_count
+
+	def traverse(self, transition_table, text, line_index=None):
+		# A line index given is filled with the text.
+		return list(self._tokens(self._arrays(transition_table), self._index_lines([text], line_index)))
+
+	def iter_tokens(self, transition_table, text):
+		# Like traverse(), but yields the tokens as soon as they are finalized.
+		return self._tokens(self._arrays(transition_table), [text])
+
+	def process(self, transition_table, text, listener):
+		visitors = {}
+		for offset, length, rule in self._tokens(self._arrays(transition_table), [text]):
+			if rule not in visitors:
+				visitors[rule] = getattr(listener, 'visit_{0}'.format(rule), None)
+
+			info = TokenMatch(offset, length, rule, text[offset:offset + length])
+			listener.before_token(info)
+			if visitors[rule] is not None:
+				visitors[rule](info)
+			listener.after_token(info)
+
+	def traverse_classes(self, transition_table, text, text_classes):
+		# Like traverse(), but the class of every character of the text is read from a
+		# sequence of class ids computed beforehand, like NumpyTransitionTable.classify()
+		# does. Linear and recovery modes lex the text itself.
+		if self._linear or self._recover:
+			return self.traverse(transition_table, text)
+
+		arrays = self._arrays(transition_table)
+		munch = arrays.for_classes().munch
+		state_rules = arrays.state_rules
 
 		output = []
+		text_length = len(text_classes)
+		offset = 0
+		while offset < text_length:
+			accept_state, accept_index, index = munch(text_classes, offset)
+			if accept_state == -1:
+				raise arrays.failure(text, index)
+
+			for rule in state_rules[accept_state]:
+				output.append((offset, accept_index - offset, rule))
+			offset = accept_index
+		return output
+
+	def traverse_arrays(self, transition_table, text):
+		# Like traverse(), but the tokens are stored in a TokenArrays, which takes a
+		# fraction of the memory of a list of tuples.
+		rules = transition_table.rules + ([TransitionTableTraverser.ERROR_RULE] if self._recover else [])
+		tokens = TokenArrays(rules)
+		append_offset = tokens.offsets.append
+		append_length = tokens.lengths.append
+		append_rule_id = tokens.rule_ids.append
+		for offset, length, rule_id in self._tokens(self._arrays(transition_table, rules), [text]):
+			append_offset(offset)
+			append_length(length)
+			append_rule_id(rule_id)
+		return tokens
+
+	def traverse_batch(self, transition_table, texts, processes=1, batch_size=None):
+		# Lexes every string of a sequence, preparing the table only once, and returns a
+		# TokenBatch. With several processes, the strings are split in batches that are
+		# lexed in a process pool.
+
+		rules = transition_table.rules + ([TransitionTableTraverser.ERROR_RULE] if self._recover else [])
+		arrays = self._arrays(transition_table, rules)
+		if processes is None:
+			processes = os.cpu_count() or 1
+		if batch_size is None:
+			batch_size = max(len(texts) // (processes * 4), 1)
+		if processes < 2 or len(texts) <= batch_size:
+			tokens = self._batch(arrays, rules, texts, 0)
+		else:
+			tasks = [(rules, texts[start:start + batch_size], start) for start in range(0, len(texts), batch_size)]
+
+			tokens = TokenBatch(rules)
+			with concurrent.futures.ProcessPoolExecutor(processes, initializer=_initialize_worker, initargs=(arrays, self)) as executor:
+				for batch in executor.map(_traverse_batch, tasks):
+					tokens.extend(batch)
+
+		if self._recover:
+			self._error_count = tokens.rule_ids.count(rules.index(TransitionTableTraverser.ERROR_RULE))
+		return tokens
+
+	def traverse_parallel(self, transition_table, text, processes=None, chunk_size=None):
+		# Splits the input in chunks that are lexed speculatively in a process pool, and
+		# merges them with the true token stream. Where the true stream does not start a
+		# token at a speculative boundary, it is lexed sequentially until it reaches one,
+		# so the output is the same as traverse().
+
+		if processes is None:
+			processes = os.cpu_count() or 1
+		if chunk_size is None:
+			chunk_size = max(len(text) // (processes * 4), TransitionTableTraverser.PARALLEL_CHUNK_SIZE)
+		if processes < 2 or len(text) <= chunk_size:
+			return self.traverse(transition_table, text)
+
+		arrays = self._arrays(transition_table)
+		# Slices of buffers like memoryview can't be pickled for the pool.
+		tasks = [
+			(bytes(text[start:start + chunk_size]) if isinstance(text, memoryview) else text[start:start + chunk_size],
+				start, start + chunk_size >= len(text))
+			for start in range(0, len(text), chunk_size)]
+
+		with concurrent.futures.ProcessPoolExecutor(processes, initializer=_initialize_worker, initargs=(arrays, self)) as executor:
+			speculations = list(executor.map(_speculate, tasks))
+
+		starts = {}
+		for tokens in speculations:
+			for index, (offset, length, rule) in enumerate(tokens):
+				if offset not in starts:
+					starts[offset] = (tokens, index)
+
+		output = []
+		position = 0
+		while position < len(text):
+			if position in starts:
+				tokens, index = starts[position]
+				output.extend(tokens[index:])
+				offset, length, rule = tokens[-1]
+				position = offset + length
+				continue
+
+			start = position
+			position = len(text)
+			for offset, length, rule in self._tokens(arrays, self._read_text(text, start)):
+				offset = start + offset
+				if offset != start and offset in starts:
+					position = offset
+					break
+				output.append((offset, length, rule))
+
+		# The error tokens found by the workers weren't counted here.
+		if self._recover:
+			self._error_count = sum(1 for offset, length, rule in output if rule == TransitionTableTraverser.ERROR_RULE)
+		return output
+
+	def traverse_stream(self, transition_table, source, chunk_size=CHUNK_SIZE, line_index=None):
+		# Lexes a file object or an iterable of text chunks, yielding the tokens as soon
+		# as they are finalized. Only the text of the pending token is kept between
+		# chunks, so memory is bounded by the chunk size and the longest token. A line
+		# index given is filled with the chunks as they are read.
+		chunks = self._index_lines(self._read_chunks(source, chunk_size), line_index)
+		return self._tokens(self._arrays(transition_table), chunks)
+
+	def _batch(self, arrays, rules, texts, start):
+		# Short strings are lexed by plain maximal munch steps, which are cheaper to set
+		# up than _tokens(); linear and recovery modes still need the latter.
+		munch = arrays.munch
+		state_rules = arrays.state_rules
+
+		tokens = TokenBatch(rules)
+		offsets = tokens.offsets
+		lengths = tokens.lengths
+		rule_ids = tokens.rule_ids
+		starts = tokens.starts
+		for text_index, text in enumerate(texts):
+			try:
+				if self._linear or self._recover:
+					for offset, length, rule_id in self._tokens(arrays, (text,)):
+						offsets.append(offset)
+						lengths.append(length)
+						rule_ids.append(rule_id)
+					starts.append(len(offsets))
+					continue
+
+				text_length = len(text)
+				offset = 0
+				while offset < text_length:
+					accept_state, accept_index, index = munch(text, offset)
+					if accept_state == -1:
+						raise arrays.failure(text, index)
+
+					for rule_id in state_rules[accept_state]:
+						offsets.append(offset)
+						lengths.append(accept_index - offset)
+						rule_ids.append(rule_id)
+					offset = accept_index
+			except LexerError as err:
+				raise LexerError('String {0}: {1}'.format(start + text_index, err.args[0]))
+			starts.append(len(offsets))
+		return tokens
+
+	def _read_text(self, text, start):
+		for offset in range(start, len(text), TransitionTableTraverser.CHUNK_SIZE):
+			yield text[offset:offset + TransitionTableTraverser.CHUNK_SIZE]
+
+	def _arrays(self, transition_table, rules=None):
+		# When a rule table is given, the tokens hold indexes into it instead of names.
+		# The classes that some rule starts with are the ones the start state moves on.
+		channels = [TokenChannels.DEFAULT, TokenChannels.HIDDEN] if self._hidden else [TokenChannels.DEFAULT]
+		emitted = set(r for r in transition_table.rules if transition_table.channels.get(r, TokenChannels.DEFAULT) in channels)
+
+		accepting = [len(s.rules) > 0 for s in transition_table.states]
+		state_rules = [[r for r in s.rules if r in emitted] for s in transition_table.states]
+		error_rule = TransitionTableTraverser.ERROR_RULE
+		if rules is not None:
+			rule_ids = dict((rule, index) for index, rule in enumerate(rules))
+			state_rules = [[rule_ids[r] for r in state] for state in state_rules]
+			error_rule = rule_ids.get(error_rule, -1)
+
+		class_count = transition_table.alphabet.class_count
+		startable = [t != TransitionTable.NO_MOVE for t in transition_table.transitions[:class_count]]
+
+		return _TableArrays(
+			transition_table.transitions,
+			class_count,
+			transition_table.alphabet.classes,
+			accepting,
+			state_rules,
+			startable,
+			error_rule,
+			[s.skip for s in transition_table.states])
+
+	def _index_lines(self, chunks, line_index):
+		if line_index is None:
+			return chunks
+		return self._indexed_chunks(chunks, line_index)
+
+	def _indexed_chunks(self, chunks, line_index):
+		for chunk in chunks:
+			line_index.add_text(chunk)
+			yield chunk
+
+	def _read_chunks(self, source, chunk_size):
+		if hasattr(source, 'read'):
+			while True:
+				chunk = source.read(chunk_size)
+				if not chunk:
+					break
+				yield chunk
+		else:
+			for chunk in source:
+				yield chunk
+
+	def _tokens(self, arrays, chunks):
+		transitions = arrays.transitions
+		class_count = arrays.class_count
+		classes = arrays.classes
+		accepting = arrays.accepting
+		state_rules = arrays.state_rules
+		startable = arrays.startable
+		error_rule = arrays.error_rule
+		skips = arrays.skips
+		state_count = len(state_rules)
+		self._error_count = 0
+
+		# Failed pairs map to the index where their scan dies, or -1 at the end of file.
+		failed = {} if self._linear else None
+		failed_limit = TransitionTableTraverser.CHUNK_SIZE
+		trail = []
+
+		chunks = iter(chunks)
+		text = next(chunks, '')
+		base = 0
+		eof = False
+
+		current_state = 0
 
 		token_offset = 0
 		index = 0
 
-		last_valid_state = None
+		last_valid_state = -1
 		last_valid_index = -1
 
-		while token_offset < len(text):
-			if len(current_state.rules) > 0:
+		# The offset where the text being skipped after a failure starts, or -1.
+		error_start = -1
+
+		while not eof or token_offset < len(text) or error_start != -1:
+			if index == len(text) and not eof:
+				# Offsets are relative to the buffer, which only keeps the text from the
+				# start of the pending token.
+				chunk = next(chunks, None)
+				if chunk is None:
+					eof = True
+				else:
+					# Buffers like memoryview can't be concatenated; the pending text
+					# is copied to bytes first.
+					pending = text[token_offset:]
+					if isinstance(pending, memoryview):
+						pending = pending.tobytes()
+					text = pending + chunk
+					base = base + token_offset
+					index = index - token_offset
+					if last_valid_index != -1:
+						last_valid_index = last_valid_index - token_offset
+					if failed is not None and token_offset > 0:
+						shift = token_offset * state_count
+						failed = dict(
+							(k - shift, d - token_offset if d != -1 else -1)
+							for k, d in failed.items() if k >= shift)
+						trail = [k - shift for k in trail]
+					token_offset = 0
+				continue
+
+			if error_start != -1:
+				if index < len(text) and not startable[classes[text[index]]]:
+					index = index + 1
+					token_offset = index
+				else:
+					yield (error_start, base + index - error_start, error_rule)
+					error_start = -1
+				continue
+
+			message = None
+
+			if accepting[current_state]:
 				last_valid_state = current_state
 				last_valid_index = index
+				if len(trail) > 0:
+					trail = []
 
 			if index == len(text):
-				if last_valid_state is not None and last_valid_index != token_offset:
-					for r in last_valid_state.rules:
-						output.append((token_offset, last_valid_index - token_offset, r))
-					current_state = start_state
+				if failed is not None:
+					for k in trail:
+						failed[k] = -1
+					trail = []
+
+				if last_valid_state != -1 and last_valid_index != token_offset:
+					for r in state_rules[last_valid_state]:
+						yield (base + token_offset, last_valid_index - token_offset, r)
+					current_state = 0
 					token_offset = last_valid_index
 					index = last_valid_index
-					last_valid_state = None
+					last_valid_state = -1
 					last_valid_index = -1
 				else:
-					raise LexerError('End of file found without any matching rule.')
+					message = 'End of file found without any matching rule.'
 
 			else:
-				next_state = current_state.on(text[index])
-				if next_state is None:
-					if last_valid_state is not None and last_valid_index != token_offset:
-						for r in last_valid_state.rules:
-							output.append((token_offset, last_valid_index - token_offset, r))
-						current_state = start_state
+				char = text[index]
+				next_state = transitions[current_state * class_count + classes[char]]
+				if failed is not None:
+					death = index
+					if next_state != TransitionTable.NO_MOVE:
+						key = (index + 1) * state_count + next_state
+						if key in failed:
+							next_state = TransitionTable.NO_MOVE
+							death = failed[key]
+						else:
+							trail.append(key)
+					if next_state == TransitionTable.NO_MOVE:
+						for k in trail:
+							failed[k] = death
+						trail = []
+						if len(failed) > failed_limit:
+							# Pairs before the token being scanned can't be reached anymore.
+							failed = dict((k, d) for k, d in failed.items() if k >= token_offset * state_count)
+							failed_limit = 2 * len(failed) + TransitionTableTraverser.CHUNK_SIZE
+						if death != -1:
+							char = text[death]
+						elif last_valid_state == -1 or last_valid_index == token_offset:
+							message = 'End of file found without any matching rule.'
+
+				if next_state == TransitionTable.NO_MOVE:
+					if last_valid_state != -1 and last_valid_index != token_offset:
+						for r in state_rules[last_valid_state]:
+							yield (base + token_offset, last_valid_index - token_offset, r)
+						current_state = 0
 						token_offset = last_valid_index
 						index = last_valid_index
-						last_valid_state = None
+						last_valid_state = -1
 						last_valid_index = -1
-					else:
-						raise LexerError('Failed to match \'{0}\' character'.format(text[index]))
+					elif message is None and isinstance(char, int):
+						message = 'Failed to match byte 0x{0:02x}'.format(char)
+					elif message is None:
+						message = 'Failed to match \'{0}\' character'.format(char)
 				else:
 					current_state = next_state
 					index = index + 1
+					if failed is None and skips[next_state] is not None:
+						# Linear mode needs every (state, position) pair visited.
+						index = skips[next_state].match(text, index).end()
+
+			if message is not None:
+				if not self._recover:
+					raise LexerError(message)
+
+				self._error_count = self._error_count + 1
+				error_start = base + token_offset
+				current_state = 0
+				index = token_offset + 1
+				token_offset = index
+				last_valid_state = -1
+				last_valid_index = -1
+
+class _TokenBlock:
+	# A run of consecutive tokens, with their offsets from the start of the block, and
+	# the text from the start of the block to the start of the next one.
+
+	def __init__(self, text, tokens, lookaheads):
+		self.text = text
+		self.tokens = tokens
+		self.lookaheads = lookaheads
+
+class _PrefixSums:
+	# The sums of the first values of a list of positive values, which are changed and
+	# searched in logarithmic time (a Fenwick tree).
+
+	def __init__(self, values):
+		self._tree = [0] + list(values)
+		for index in range(1, len(self._tree)):
+			parent = index + (index & -index)
+			if parent < len(self._tree):
+				self._tree[parent] = self._tree[parent] + self._tree[index]
+
+	def __len__(self):
+		return len(self._tree) - 1
+
+	def sum(self, count):
+		# The sum of the first count values.
+		total = 0
+		while count > 0:
+			total = total + self._tree[count]
+			count = count & (count - 1)
+		return total
+
+	def add(self, index, value):
+		index = index + 1
+		while index < len(self._tree):
+			self._tree[index] = self._tree[index] + value
+			index = index + (index & -index)
+
+	def search(self, total):
+		# The largest count of first values whose sum is at most the total.
+		count = 0
+		step = 1 << (len(self).bit_length() - 1) if len(self) > 0 else 0
+		while step > 0:
+			if count + step <= len(self) and self._tree[count + step] <= total:
+				count = count + step
+				total = total - self._tree[count]
+			step = step >> 1
+		return count
+
+class IncrementalTraverser:
+	# Keeps the tokens of a text up to date while the text is edited. Along with every
+	# token it remembers how far past its end the scan that found it read, so an edit
+	# only re-lexes from the first token whose scan read into the edited text, and stops
+	# as soon as a new token ends where an old token after the edit starts: from there
+	# on, the old tokens are the same, only shifted.
+	#
+	# The tokens and the text are kept in blocks of about BLOCK_SIZE tokens. Offsets in
+	# a block are relative to its start, and the starts of the blocks and the indexes of
+	# their first tokens are prefix sums of their lengths and token counts, so an edit
+	# rebuilds the blocks it re-lexes and finds and moves the others in logarithmic
+	# time. The rebuilt blocks keep their number while they hold between half and twice
+	# BLOCK_SIZE tokens; otherwise they are split again, and the prefix sums rebuilt.
+	# Reading the text or the tokens joins the blocks, which takes time proportional to
+	# the whole text.
+
+	BLOCK_SIZE = 256
+
+	def __init__(self, transition_table, text=''):
+		self._arrays = TransitionTableTraverser()._arrays(transition_table)
+		# Skipped and hidden tokens are kept too: their lookaheads matter for the edits.
+		self._state_rules = [s.rules for s in transition_table.states]
+		self._blocks = []
+		self._lengths = _PrefixSums([])
+		self._counts = _PrefixSums([])
+		self._lookahead_counts = {}
+		self.edit(0, 0, text)
 
-		return output
+	def __repr__(self):
+		return '{0} {1}'.format(self.__class__.__name__, str(self.__dict__))
+
+	@property
+	def text(self):
+		return ''.join(b.text for b in self._blocks)
+
+	@property
+	def tokens(self):
+		tokens = []
+		start = 0
+		for b in self._blocks:
+			tokens.extend((start + o, l, r) for o, l, r in b.tokens)
+			start = start + len(b.text)
+		return tokens
+
+	def edit(self, offset, removed, inserted):
+		# Replaces the removed characters at the offset with the inserted text. Returns
+		# the index of the first token that changed, how many old tokens were replaced,
+		# the tokens that replace them, and how far the tokens after them moved: the
+		# offset of each one is shifted by the change in the length of the text. If the
+		# new text can't be lexed, nothing is changed.
+
+		blocks = self._blocks
+		delta = len(inserted) - removed
+		old_length = self._length()
+		new_length = old_length + delta
+
+		# A scan reads at most the longest lookahead past the end of its token.
+		max_lookahead = max(self._lookahead_counts) if len(self._lookahead_counts) > 0 else 0
+		restart = (0, 0)
+		block = self._block_at(offset)
+		if len(blocks) > 0:
+			block_start = self._start(block)
+			restart = (block, bisect.bisect_right(blocks[block].tokens, offset - block_start, key=lambda t: t[0]))
+		index = restart[1] - 1
+		while block >= 0:
+			if index < 0:
+				block = block - 1
+				if block >= 0:
+					index = len(blocks[block].tokens) - 1
+					block_start = block_start - len(blocks[block].text)
+				continue
+			o, l, r = blocks[block].tokens[index]
+			end = block_start + o + l
+			if end + max_lookahead <= offset:
+				break
+			if end + blocks[block].lookaheads[index] > offset:
+				restart = (block, index)
+			index = index - 1
+		restart = self._cursor(*restart)
+
+		# The re-lexed text is read from a window, which grows as the scans need it.
+		position = self._offset(restart, old_length)
+		window_start = position
+		window_end = offset + removed
+		window = self._slice(position, offset) + inserted
+		read_size = 1024
+
+		next_old = restart
+		tokens = []
+		token_lookaheads = []
+		while position < new_length:
+			if position >= offset + len(inserted):
+				while self._offset(next_old, old_length) < position - delta:
+					next_old = self._cursor(next_old[0], next_old[1] + 1)
+				if self._offset(next_old, old_length) == position - delta and position - delta >= offset + removed:
+					break
+
+			scan = self._scan(window, position - window_start, window_end >= old_length)
+			if scan is None:
+				window = window + self._slice(window_end, window_end + read_size)
+				window_end = window_end + read_size
+				read_size = read_size * 2
+				continue
+
+			length, rules, lookahead = scan
+			for rule in rules:
+				tokens.append((position, length, rule))
+				token_lookaheads.append(lookahead)
+			position = position + length
+		else:
+			next_old = self._cursor(len(blocks) - 1, len(blocks[-1].tokens)) if len(blocks) > 0 else (0, 0)
+
+		# The blocks from the restart to the first old token kept are rebuilt around the
+		# new tokens; the blocks after them are left as they are.
+		first_block, first_index = restart
+		last_block, last_index = next_old
+		kept_tokens = []
+		kept_lookaheads = []
+		base = 0
+		text = window[:position - window_start]
+		if len(blocks) > 0:
+			base = self._start(first_block)
+			prefix = blocks[first_block]
+			kept_tokens = [(base + o, l, r) for o, l, r in prefix.tokens[:first_index]]
+			kept_lookaheads = prefix.lookaheads[:first_index]
+			text = prefix.text[:window_start - base] + text
+			suffix = blocks[last_block]
+			text = text + suffix.text[position - delta - self._start(last_block):]
+
+		replaced = []
+		for block in range(first_block, last_block + 1 if len(blocks) > 0 else 0):
+			start = first_index if block == first_block else 0
+			stop = last_index if block == last_block else len(blocks[block].lookaheads)
+			replaced.extend(blocks[block].lookaheads[start:stop])
+		for lookahead in replaced:
+			self._lookahead_counts[lookahead] = self._lookahead_counts[lookahead] - 1
+			if self._lookahead_counts[lookahead] == 0:
+				del self._lookahead_counts[lookahead]
+		for lookahead in token_lookaheads:
+			self._lookahead_counts[lookahead] = self._lookahead_counts.get(lookahead, 0) + 1
+
+		all_tokens = kept_tokens + tokens
+		all_lookaheads = kept_lookaheads + token_lookaheads
+		if len(blocks) > 0:
+			suffix = blocks[last_block]
+			suffix_start = self._start(last_block) + delta
+			all_tokens.extend((suffix_start + o, l, r) for o, l, r in suffix.tokens[last_index:])
+			all_lookaheads.extend(suffix.lookaheads[last_index:])
+
+		old_count = last_block + 1 - first_block if len(blocks) > 0 else 0
+		count = old_count
+		if not max(self.BLOCK_SIZE // 2, 1) * count <= len(all_tokens) <= self.BLOCK_SIZE * 2 * count:
+			count = -(-len(all_tokens) // self.BLOCK_SIZE)
+		new_blocks = []
+		for block in range(count):
+			first = len(all_tokens) * block // count
+			last = len(all_tokens) * (block + 1) // count
+			block_start = all_tokens[first][0]
+			block_end = all_tokens[last][0] if last < len(all_tokens) else base + len(text)
+			new_blocks.append(_TokenBlock(
+				text[block_start - base:block_end - base],
+				[(o - block_start, l, r) for o, l, r in all_tokens[first:last]],
+				all_lookaheads[first:last]))
+
+		first_token = self._counts.sum(first_block) + first_index
+		if count == old_count:
+			for block, new_block in enumerate(new_blocks, first_block):
+				self._lengths.add(block, len(new_block.text) - len(blocks[block].text))
+				self._counts.add(block, len(new_block.tokens) - len(blocks[block].tokens))
+				blocks[block] = new_block
+		else:
+			blocks[first_block:first_block + old_count] = new_blocks
+			self._lengths = _PrefixSums(len(b.text) for b in blocks)
+			self._counts = _PrefixSums(len(b.tokens) for b in blocks)
+		return first_token, len(replaced), tokens, delta
+
+	def _length(self):
+		return self._lengths.sum(len(self._lengths))
+
+	def _start(self, block):
+		return self._lengths.sum(block)
+
+	def _block_at(self, offset):
+		# The block whose text holds the offset, or the last one.
+		return max(min(self._lengths.search(offset), len(self._blocks) - 1), 0)
+
+	def _cursor(self, block, index):
+		# A token as the index of its block and its index in the block. The end of a
+		# block is the start of the next one.
+		if block < len(self._blocks) - 1 and index == len(self._blocks[block].tokens):
+			return block + 1, 0
+		return block, index
+
+	def _offset(self, cursor, length):
+		block, index = cursor
+		if block < len(self._blocks) and index < len(self._blocks[block].tokens):
+			return self._start(block) + self._blocks[block].tokens[index][0]
+		return length
+
+	def _slice(self, start, end):
+		# The text between two offsets.
+		if start >= end or len(self._blocks) == 0:
+			return ''
+		block = self._block_at(start)
+		base = self._start(block)
+		pieces = []
+		while block < len(self._blocks) and base < end:
+			text = self._blocks[block].text
+			pieces.append(text[max(start - base, 0):end - base])
+			base = base + len(text)
+			block = block + 1
+		return ''.join(pieces)
+
+	def _scan(self, text, start, at_end):
+		# Finds the longest token at the start, and how many characters past its end the
+		# scan read, counting the end of file as one more character. Returns None if the
+		# scan needs more text than there is and the text is not the end of file.
+		accept_state, accept_index, index = self._arrays.munch(text, start)
+		if index == len(text) and not at_end:
+			return None
+		if accept_state == -1:
+			raise self._arrays.failure(text, index)
+
+		return accept_index - start, self._state_rules[accept_state], index + 1 - accept_index
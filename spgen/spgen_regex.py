@@ -0,0 +1,358 @@
+#
+# spgen_regex.py
+#
+# Copyright (c) 2013 Luis Garcia.
+# This source file is subject to terms of the MIT License. (See accompanying file LICENSE)
+#
+
+import re
+from spgen_parser import *
+from spgen_processor import *
+
+def _escape_code_point(code_point):
+	return '\\U{0:08x}'.format(code_point)
+
+_letter_class_cache = None
+
+def _letter_class():
+	# re tests the ranges of a class above U+FFFF one by one, so they are kept in a
+	# separate class, only tried for such characters; the others are looked up in a
+	# table.
+	global _letter_class_cache
+	if _letter_class_cache is None:
+		intervals = [(first, last) for first, last, kind in char_kind_intervals() if kind == CharKind.LETTER]
+		def ranges(intervals):
+			return ''.join('{0}-{1}'.format(_escape_code_point(first), _escape_code_point(last)) for first, last in intervals)
+		_letter_class_cache = (
+			ranges((first, min(last, 0xFFFF)) for first, last in intervals if first <= 0xFFFF),
+			ranges((max(first, 0x10000), last) for first, last in intervals if last > 0xFFFF))
+	return _letter_class_cache
+
+def _input_pattern(acceptor):
+	if acceptor._is_char():
+		return re.escape(acceptor._get_char())
+
+	special = {
+		LexerInput.ANY        : lambda: '(?s:.)',
+		LexerInput.DIGIT      : lambda: '[0-9]',
+		LexerInput.NON_DIGIT  : lambda: '[^0-9]',
+		LexerInput.LETTER     : lambda: '(?:[{0}]|(?=[\\U00010000-\\U0010ffff])[{1}])'.format(*_letter_class()),
+		LexerInput.NON_LETTER : lambda: '(?![{0}]|(?=[\\U00010000-\\U0010ffff])[{1}])(?s:.)'.format(*_letter_class()),
+		LexerInput.WHITESPACE : lambda: '[ \\t\\n\\r\\x0b\\x0c]' }
+
+	return special[acceptor]()
+
+class _RuleExpression:
+	# A regular expression translated from a grammar, along with its Glushkov positions,
+	# which tell whether the expression is deterministic, and whether it has an
+	# alternative that matches an empty string.
+
+	def __init__(self, pattern, nullable, first, last, nullable_branch=False):
+		self.pattern = pattern
+		self.nullable = nullable
+		self.first = first
+		self.last = last
+		self.nullable_branch = nullable_branch
+
+class MasterPattern:
+	def __init__(self):
+		self._transition_table = None
+		self._fallback_reason = None
+		self._pattern = None
+		self._group_rules = {}
+		self._rule_patterns = {}
+		self._conflicts = {}
+		self._keywords = {}
+		self._keyword_rules = set()
+
+	def __repr__(self):
+		return '{0} {1}'.format(self.__class__.__name__, str(self.__dict__))
+
+	@property
+	def transition_table(self):
+		return self._transition_table
+
+	@transition_table.setter
+	def transition_table(self, value):
+		self._transition_table = value
+
+	@property
+	def fallback_reason(self):
+		return self._fallback_reason
+
+	@fallback_reason.setter
+	def fallback_reason(self, value):
+		self._fallback_reason = value
+
+	@property
+	def pattern(self):
+		return self._pattern
+
+	@pattern.setter
+	def pattern(self, value):
+		self._pattern = value
+
+	@property
+	def group_rules(self):
+		return self._group_rules
+
+	@property
+	def rule_patterns(self):
+		return self._rule_patterns
+
+	@property
+	def conflicts(self):
+		return self._conflicts
+
+	@property
+	def keywords(self):
+		return self._keywords
+
+	@property
+	def keyword_rules(self):
+		return self._keyword_rules
+
+class MasterPatternGenerator:
+	# Translates the token rules into a single regular expression with a named group per
+	# rule, for the re engine to do the lexing. The translation keeps the semantics of the
+	# transition table only if:
+	#
+	#  - every rule is a deterministic expression (no two Glushkov positions reachable at
+	#    the same point overlap), so the greedy match of re is the longest match;
+	#  - no alternative of a rule matches an empty string, since re takes the first
+	#    alternative that matches, even if it matches nothing;
+	#  - a rule that matches an empty string matches something once it reads any of its
+	#    first inputs, so the lookahead on them rules out empty matches.
+	#
+	# Literals that another rule also matches are keywords: where one matches, the other
+	# rule matches at least as far, so keywords are left out of the pattern and looked
+	# up in the text matched. Other rules whose first inputs overlap are matched one by
+	# one to find the longest match, unless all of them are different literals, which
+	# are just tried longest first. Ties go to the rule the transition table gives
+	# priority to. When any condition does not hold, the master pattern falls back to
+	# the transition table.
+
+	def generate(self, context, transition_table):
+		master_pattern = MasterPattern()
+		master_pattern.transition_table = transition_table
+
+		token_rules = [r for r in context.rules.values() if r.type == RuleTypes.TOKEN]
+
+		expressions = {}
+		for rule in token_rules:
+			follow = {}
+			positions = []
+			expression = self.translate(rule.grammar, context.rules, positions, follow)
+			if not self.is_deterministic(positions, [expression.first] + list(follow.values())):
+				master_pattern.fallback_reason = 'Rule \'{0}\' is not deterministic.'.format(rule.name)
+				return master_pattern
+			reason = self.check_empty_matches(rule.name, expression)
+			if reason is not None:
+				master_pattern.fallback_reason = reason
+				return master_pattern
+			expressions[rule.name] = (expression, [positions[p] for p in expression.first])
+
+		literals = dict((rule.name, self.literal(rule.grammar)) for rule in token_rules)
+		for rule in token_rules:
+			master_pattern.rule_patterns[rule.name] = re.compile(expressions[rule.name][0].pattern)
+
+		for rule in token_rules:
+			literal = literals[rule.name]
+			if literal is None:
+				continue
+			keyword_rules = [
+				r.name for r in token_rules
+				if literals[r.name] is None and master_pattern.rule_patterns[r.name].fullmatch(literal)]
+			if len(keyword_rules) > 0:
+				# Of the rules of the same literal, the first one declared has priority.
+				master_pattern.keywords.setdefault(literal, rule.name)
+				master_pattern.keyword_rules.update(keyword_rules)
+
+		pattern_rules = [r for r in token_rules if literals[r.name] not in master_pattern.keywords]
+		for rule in pattern_rules:
+			conflicts = [
+				r.name for r in pattern_rules
+				if self.overlap(expressions[rule.name][1], expressions[r.name][1])]
+			if all(literals[r] is not None for r in conflicts) and len(set(literals[r] for r in conflicts)) == len(conflicts):
+				# Different literals are tried longest first, so the first match is the longest.
+				conflicts = [rule.name]
+			master_pattern.conflicts[rule.name] = conflicts
+
+		alternatives = []
+		for index, rule in enumerate(token_rules):
+			if rule not in pattern_rules:
+				continue
+			expression, first = expressions[rule.name]
+			if len(first) == 0:
+				continue
+
+			guard = ''
+			if expression.nullable:
+				guard = '(?=(?:{0}))'.format('|'.join(_input_pattern(a) for a in first))
+
+			group = 'g{0}'.format(index)
+			master_pattern.group_rules[group] = rule.name
+			length = len(literals[rule.name]) if literals[rule.name] is not None else 0
+			alternatives.append((-length, index, '(?P<{0}>{1}{2})'.format(group, guard, expression.pattern)))
+
+		alternatives = [a for length, index, a in sorted(alternatives)]
+		master_pattern.pattern = re.compile('|'.join(alternatives) if len(alternatives) > 0 else '(?!)')
+		return master_pattern
+
+	def check_empty_matches(self, name, expression):
+		if expression.nullable_branch:
+			return 'Rule \'{0}\' has an alternative that matches an empty string.'.format(name)
+		if expression.nullable and any(p not in expression.last for p in expression.first):
+			return 'Rule \'{0}\' can match an empty string after its first input.'.format(name)
+		return None
+
+	def literal(self, grammar):
+		if isinstance(grammar, GrammarConstant) and all(not isinstance(c, SpecialInput) for c in grammar.value):
+			return ''.join(grammar.value)
+		return None
+
+	def overlap(self, a_inputs, b_inputs):
+		return any(LexerInput.match(a, b) for a in a_inputs for b in b_inputs)
+
+	def is_deterministic(self, positions, position_sets):
+		for position_set in position_sets:
+			inputs = [positions[p] for p in position_set]
+			for i, a in enumerate(inputs):
+				for b in inputs[i + 1:]:
+					if LexerInput.match(a, b):
+						return False
+		return True
+
+	def translate(self, grammar, rules, positions, follow):
+		if isinstance(grammar, GrammarConstant):
+			patterns = []
+			first = []
+			last = []
+			for char in grammar.value:
+				position = len(positions)
+				positions.append(LexerInput.input(char))
+				follow[position] = []
+				patterns.append(_input_pattern(positions[position]))
+				if len(last) == 0:
+					first = [position]
+				else:
+					follow[last[0]].append(position)
+				last = [position]
+			return _RuleExpression(''.join(patterns), len(patterns) == 0, first, last)
+
+		elif isinstance(grammar, GrammarExpressionList):
+			result = _RuleExpression('', True, [], [])
+			for expr in grammar.list:
+				expression = self.translate(expr, rules, positions, follow)
+				for p in result.last:
+					follow[p].extend(expression.first)
+				result = _RuleExpression(
+					result.pattern + expression.pattern,
+					result.nullable and expression.nullable,
+					result.first + (expression.first if result.nullable else []),
+					expression.last + (result.last if expression.nullable else []),
+					result.nullable_branch or expression.nullable_branch)
+			return result
+
+		elif isinstance(grammar, GrammarOrExpressionList):
+			expressions = [self.translate(expr, rules, positions, follow) for expr in grammar.list]
+			return _RuleExpression(
+				'(?:{0})'.format('|'.join(e.pattern for e in expressions)),
+				any(e.nullable for e in expressions),
+				[p for e in expressions for p in e.first],
+				[p for e in expressions for p in e.last],
+				any(e.nullable or e.nullable_branch for e in expressions))
+
+		elif isinstance(grammar, GrammarZeroOrOne):
+			expression = self.translate(grammar.expression, rules, positions, follow)
+			return _RuleExpression('(?:{0})?'.format(expression.pattern), True, expression.first, expression.last,
+				expression.nullable_branch)
+
+		elif isinstance(grammar, GrammarZeroOrMany) or isinstance(grammar, GrammarOneOrMany):
+			expression = self.translate(grammar.expression, rules, positions, follow)
+			for p in expression.last:
+				follow[p].extend(expression.first)
+			if isinstance(grammar, GrammarZeroOrMany):
+				return _RuleExpression('(?:{0})*'.format(expression.pattern), True, expression.first, expression.last,
+					expression.nullable_branch)
+			return _RuleExpression('(?:{0})+'.format(expression.pattern), expression.nullable, expression.first, expression.last,
+				expression.nullable_branch)
+
+		elif isinstance(grammar, GrammarReference):
+			return self.translate(rules[grammar.identifier].grammar, rules, positions, follow)
+
+		else:
+			raise NotImplementedError('The {0} expression has no implementation.'.format(grammar.__class__.__name__))
+
+class MasterPatternTraverser:
+	def __init__(self, hidden=False):
+		self._hidden = hidden
+
+	@property
+	def hidden(self):
+		return self._hidden
+
+	def traverse(self, master_pattern, text):
+		if master_pattern.fallback_reason is not None:
+			return TransitionTableTraverser(hidden=self._hidden).traverse(master_pattern.transition_table, text)
+
+		pattern = master_pattern.pattern
+		group_rules = master_pattern.group_rules
+		conflicts = master_pattern.conflicts
+		rule_patterns = master_pattern.rule_patterns
+		keywords = master_pattern.keywords
+		keyword_rules = master_pattern.keyword_rules
+		priorities = dict((r, index) for index, r in enumerate(master_pattern.transition_table.rules))
+		channels = [TokenChannels.DEFAULT, TokenChannels.HIDDEN] if self._hidden else [TokenChannels.DEFAULT]
+		emitted = set(r for r in priorities if master_pattern.transition_table.channels.get(r, TokenChannels.DEFAULT) in channels)
+		conflicting = set(r for r in conflicts if len(conflicts[r]) > 1)
+
+		output = []
+		append = output.append
+		length = len(text)
+
+		# A scanner matches each token where the previous one ended, without the cost of a
+		# match call per token; it is restarted when a conflict moves the end of a token.
+		match = pattern.scanner(text).match
+		offset = 0
+		while offset < length:
+			m = match()
+			if m is None or m.end() == offset:
+				return self._hand_off(master_pattern, text, offset, output)
+
+			end = m.end()
+			rule = group_rules[m.lastgroup]
+			if rule in conflicting:
+				scanned = end
+				matched = []
+				for r in conflicts[rule]:
+					m = rule_patterns[r].match(text, offset)
+					if m is not None and m.end() > offset:
+						if m.end() > end:
+							end = m.end()
+							matched = []
+						if m.end() == end:
+							matched.append(r)
+				if len(matched) == 0:
+					return self._hand_off(master_pattern, text, offset, output)
+				rule = min(matched, key=priorities.__getitem__)
+				keyword = keywords.get(text[offset:end]) if not keyword_rules.isdisjoint(matched) else None
+				if end != scanned:
+					match = pattern.scanner(text, end).match
+			else:
+				keyword = keywords.get(text[offset:end]) if rule in keyword_rules else None
+
+			if keyword is not None and priorities[keyword] < priorities[rule]:
+				rule = keyword
+			if rule in emitted:
+				append((offset, end - offset, rule))
+			offset = end
+
+		return output
+
+	def _hand_off(self, master_pattern, text, offset, output):
+		# Lexes the rest of the text with the transition table, which also reports the
+		# failures as it would have.
+		tokens = TransitionTableTraverser(hidden=self._hidden).traverse(master_pattern.transition_table, text[offset:])
+		output.extend((offset + o, l, r) for o, l, r in tokens)
+		return output
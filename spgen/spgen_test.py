@@ -5,9 +5,23 @@
 # This source file is subject to terms of the MIT License. (See accompanying file LICENSE)
 # 
 
+import contextlib
+import gc
+import io
+import os
+import tempfile
+import types
 import unittest
 from spgen_parser import *
 from spgen_processor import *
+from spgen_regex import *
+import generators.python
+import spgen
+
+try:
+	import spgen_numpy
+except ImportError:
+	spgen_numpy = None
 
 class TestParser(unittest.TestCase):
 	def test_eof_detection_1(self):
@@ -222,6 +236,24 @@ class TestParser(unittest.TestCase):
 		result, token_info = Parser().try_token(SourceIterator('token t : ()* | b ;'))
 		self.assertEqual(result, False)
 
+	def test_token_detection_18(self):
+		result, token_info = Parser().try_token(SourceIterator('token ws : \' \'+ -> skip ;'))
+		self.assertEqual(result, True)
+		self.assertEqual(token_info, TokenInfo('ws', GrammarOneOrMany(GrammarConstant(' ')), TokenChannels.SKIP))
+
+	def test_token_detection_19(self):
+		result, token_info = Parser().try_token(SourceIterator('token comment : \'#\' \'\\W\'* ->hidden;'))
+		self.assertEqual(result, True)
+		self.assertEqual(token_info.channel, TokenChannels.HIDDEN)
+
+	def test_token_detection_20(self):
+		result, token_info = Parser().try_token(SourceIterator('token ws : \' \' -> ignore ;'))
+		self.assertEqual(result, False)
+
+	def test_token_detection_21(self):
+		result, token_info = Parser().try_token(SourceIterator('token ws : \' \' -> ;'))
+		self.assertEqual(result, False)
+
 	def test_fragment_detection_1(self):
 		result, fragment_info = Parser().try_fragment(SourceIterator('fragment var : \'var\';'))
 		self.assertEqual(result, True)
@@ -483,7 +515,7 @@ def create_dfa_graph(moves, accepting_states):
 		if v not in states:
 			states[v] = DFAState()
 			states[v].index = v
-		states[u].consume(i, states[v])
+		states[u].consume(CharSet.input(i) if isinstance(i, LexerInput) else i, states[v])
 
 	for u, r in accepting_states:
 		if u not in states:
@@ -495,13 +527,18 @@ def create_dfa_graph(moves, accepting_states):
 	graph.states = list(states.values())
 	return graph
 
-def match_grammar(grammar, text):
+def create_transition_table(grammar):
 	context = Context()
 	Parser().free_context(SourceIterator(grammar), context)
 	nfa_graph = NFAGraphGenerator().generate(context)
 	dfa_graph = DFAGraphGenerator().generate(nfa_graph)
-	transition_table = TransitionTableGenerator().generate(dfa_graph)
+	token_rules = [r for r in context.rules.values() if r.type == RuleTypes.TOKEN]
+	return TransitionTableGenerator().generate(dfa_graph,
+		[r.name for r in token_rules],
+		dict((r.name, r.channel) for r in token_rules))
 
+def match_grammar(grammar, text):
+	transition_table = create_transition_table(grammar)
 	return TransitionTableTraverser().traverse(transition_table, text)
 
 
@@ -691,6 +728,30 @@ class TestLexerGenerator(unittest.TestCase):
 					accepting_states = [
 						(4, 't')])
 
+	def test_nfa_generation_10(self):
+		context = Context()
+		context.rules['t'] = RuleInfo('t', RuleTypes.TOKEN,
+			GrammarExpressionList([GrammarReference('s'), GrammarReference('s')]))
+		context.rules['s'] = RuleInfo('s', RuleTypes.FRAGMENT, GrammarZeroOrOne(GrammarReference('r')))
+		context.rules['r'] = RuleInfo('r', RuleTypes.FRAGMENT, GrammarConstant('ab'))
+		generator = NFAGraphGenerator()
+		result = generator.generate(context)
+
+		expected = create_nfa_graph(
+					moves = [
+						(0, 1, LexerInput.DEFAULT),
+						(1, 2, LexerInput.char('a')),
+						(1, 3, LexerInput.DEFAULT),
+						(2, 3, LexerInput.char('b')),
+						(3, 4, LexerInput.char('a')),
+						(3, 5, LexerInput.DEFAULT),
+						(4, 5, LexerInput.char('b'))],
+					accepting_states = [
+						(5, 't')])
+
+		self.assertEqual(result, expected)
+		self.assertEqual(generator.copied_state_count, 4)
+
 	def test_dfa_generation_1(self):
 		nfa_graph = create_nfa_graph(
 					moves = [
@@ -921,6 +982,95 @@ class TestLexerGenerator(unittest.TestCase):
 
 		self.assertEqual(result, expected)
 
+	def test_epsilon_closures_1(self):
+		nfa_graph = create_nfa_graph(
+					moves = [
+						(0, 1, LexerInput.DEFAULT),
+						(1, 2, LexerInput.DEFAULT),
+						(2, 1, LexerInput.DEFAULT),
+						(2, 3, LexerInput.char('a')),
+						(3, 4, LexerInput.DEFAULT)],
+					accepting_states = [
+						(4, 't')])
+
+		result = DFAGraphGenerator().epsilon_closures(nfa_graph)
+		self.assertEqual(
+			dict((u, sorted(s.index for s in closure)) for u, closure in result.items()),
+			{ 0: [0, 1, 2], 1: [1, 2], 2: [1, 2], 3: [3, 4], 4: [4] })
+
+	def test_subset_successors_1(self):
+		nfa_graph = create_nfa_graph(
+					moves = [
+						(0, 1, LexerInput.DEFAULT),
+						(0, 2, LexerInput.DEFAULT),
+						(1, 3, LexerInput.LETTER),
+						(2, 4, LexerInput.char('a')),
+						(2, 5, LexerInput.char('1'))],
+					accepting_states = [
+						(3, 't'),
+						(4, 'u'),
+						(5, 'u')])
+
+		generator = DFAGraphGenerator()
+		generator.generate(nfa_graph)
+		result = generator.successors(generator.default_closure([nfa_graph.states[0]]))
+		self.assertEqual(
+			[(i, sorted(s.index for s in closure)) for i, closure in result],
+			[(CharSet.char('1'), [5]),
+			 (CharSet.input(LexerInput.LETTER) - CharSet.char('a'), [3]),
+			 (CharSet.char('a'), [3, 4])])
+
+	def test_epsilon_closures_2(self):
+		result = match_grammar(""" token a : ('a'?)* 'b' ; """, 'aab')
+		self.assertEqual(result, [(0, 3, 'a')])
+
+	def test_dfa_minimization_1(self):
+		dfa_graph = create_dfa_graph(
+					moves = [
+						(0, 1, LexerInput.char('f')),
+						(1, 2, LexerInput.char('o')),
+						(0, 3, LexerInput.char('b')),
+						(3, 4, LexerInput.char('o')),
+						(0, 5, LexerInput.char('x')),
+						(5, 6, LexerInput.char('o'))],
+					accepting_states = [
+						(2, ['t']),
+						(4, ['t']),
+						(6, ['u'])])
+
+		result = DFAMinimizer().minimize(dfa_graph)
+
+		expected = create_dfa_graph(
+					moves = [
+						(0, 1, LexerInput.char('f')),
+						(1, 2, LexerInput.char('o')),
+						(0, 1, LexerInput.char('b')),
+						(0, 3, LexerInput.char('x')),
+						(3, 4, LexerInput.char('o'))],
+					accepting_states = [
+						(2, ['t']),
+						(4, ['u'])])
+
+		self.assertEqual(result, expected)
+
+	def test_dfa_minimization_2(self):
+		grammar = """ token Identifier : '\\w' ('\\w' | '\\d')* ;
+		              token Number     : '\\d'+ ('.' '\\d'+)? ;
+		              token Keyword    : 'if' | 'else' ; """
+		context = Context()
+		Parser().free_context(SourceIterator(grammar), context)
+		dfa_graph = DFAGraphGenerator().generate(NFAGraphGenerator().generate(context))
+		result = DFAMinimizer().minimize(dfa_graph)
+		self.assertLess(len(result.states), len(dfa_graph.states))
+		self.assertEqual(len(DFAMinimizer().minimize(result).states), len(result.states))
+
+		rules = ['Identifier', 'Number', 'Keyword']
+		table = TransitionTableGenerator().generate(result, rules)
+		expected_table = TransitionTableGenerator().generate(dfa_graph, rules)
+		for text in ['if else1 x', '12.5 1', 'elsewhere', 'i1 e', '1.']:
+			expected = TransitionTableTraverser(recover=True).traverse(expected_table, text)
+			self.assertEqual(TransitionTableTraverser(recover=True).traverse(table, text), expected)
+
 	def test_input_matching_1(self):
 		result = LexerInput.match(LexerInput.ANY, LexerInput.char('a'))
 		self.assertEqual(result, True)
@@ -1002,6 +1152,25 @@ class TestLexerGenerator(unittest.TestCase):
 		result = LexerInput.match(LexerInput.DIGIT, LexerInput.NON_LETTER)
 		self.assertEqual(result, True)
 
+	def test_input_interning_1(self):
+		gc.collect()
+		count = LexerInput.interned_count()
+		inputs = [LexerInput.char(chr(c)) for c in range(0x4E00, 0x5E00)]
+		self.assertIs(LexerInput.char('一'), inputs[0])
+		self.assertEqual(LexerInput.interned_count(), count + 0x1000)
+		del inputs
+		gc.collect()
+		self.assertEqual(LexerInput.interned_count(), count)
+
+	def test_input_interning_2(self):
+		table = create_transition_table(""" token a : '\\w'+;
+		                                    token b : ' '; """)
+		gc.collect()
+		count = LexerInput.interned_count()
+		text = ''.join(chr(c) for c in range(0x4E00, 0x9E00)) + ' 家'
+		self.assertEqual(len(TransitionTableTraverser().traverse(table, text)), 3)
+		self.assertEqual(LexerInput.interned_count(), count)
+
 	def test_table_traverser_1(self):
 		grammar = """ token s : 'foo';
 		              token t : 'foobar'; """
@@ -1061,13 +1230,13 @@ class TestLexerGenerator(unittest.TestCase):
 		grammar = """ token a : '\\w'*;
 		              token b : 'var'; """
 		result = match_grammar(grammar, 'var')
-		self.assertEqual(result, [(0, 3, 'a'), (0, 3, 'b')])
+		self.assertEqual(result, [(0, 3, 'a')])
 
 	def test_table_traverser_11(self):
 		grammar = """ token a : 'var';
 		              token b : '\\w'*; """
 		result = match_grammar(grammar, 'var')
-		self.assertEqual(result, [(0, 3, 'a'), (0, 3, 'b')])
+		self.assertEqual(result, [(0, 3, 'a')])
 
 	def test_table_traverser_12(self):
 		grammar = """ token a : '\\w'*; """
@@ -1129,14 +1298,729 @@ class TestLexerGenerator(unittest.TestCase):
 		grammar = """ token a : ('abc' | 'cba')* ;
 		              token b : 'abccba' ; """
 		result = match_grammar(grammar, 'abccba')
-		self.assertEqual(result, [(0, 6, 'a'), (0, 6, 'b')])
+		self.assertEqual(result, [(0, 6, 'a')])
 
 	def test_table_traverser_25(self):
 		grammar = """ token a      : (abc | 'cba')* ;
 		              token b      : 'abccba' ;
 		              fragment abc : 'abc' ; """
 		result = match_grammar(grammar, 'abccba')
-		self.assertEqual(result, [(0, 6, 'a'), (0, 6, 'b')])
+		self.assertEqual(result, [(0, 6, 'a')])
+
+class TestTransitionTable(unittest.TestCase):
+	def test_transition_table_alphabet_1(self):
+		table = create_transition_table(""" token a : 'ab';
+		                                    token b : '\\d'*; """)
+		alphabet = table.alphabet
+		self.assertEqual(alphabet.classify('1'), alphabet.classify('7'))
+		self.assertEqual(alphabet.classify('x'), alphabet.classify('!'))
+		self.assertNotEqual(alphabet.classify('a'), alphabet.classify('b'))
+		self.assertNotEqual(alphabet.classify('a'), alphabet.classify('x'))
+		self.assertNotEqual(alphabet.classify('1'), alphabet.classify('x'))
+
+	def test_transition_table_alphabet_2(self):
+		table = create_transition_table(""" token a : '\\d'*;
+		                                    token b : 'var'; """)
+		alphabet = table.alphabet
+		self.assertEqual(alphabet.classify('x'), alphabet.classify('家'))
+		self.assertEqual(alphabet.classify('x'), alphabet.classify(' '))
+		self.assertNotEqual(alphabet.classify('v'), alphabet.classify('x'))
+		self.assertNotEqual(alphabet.classify('v'), alphabet.classify('a'))
+
+	def test_transition_table_alphabet_3(self):
+		table = create_transition_table(""" token a : '\\w'+;
+		                                    token b : '\\d'+;
+		                                    token c : '\\s'+; """)
+		alphabet = table.alphabet
+		letter = alphabet.kind_classes[CharKind.LETTER]
+		other = alphabet.kind_classes[CharKind.OTHER]
+		self.assertEqual([alphabet.classify(c) for c in 'aZé家'], [letter] * 4)
+		self.assertEqual([alphabet.classify(c) for c in '!_٣ '], [other] * 4)
+		self.assertEqual(alphabet.classify('7'), alphabet.kind_classes[CharKind.DIGIT])
+		self.assertEqual(alphabet.classify('\t'), alphabet.kind_classes[CharKind.WHITESPACE])
+		self.assertTrue(LexerInput.match(LexerInput.LETTER, LexerInput.char('é')))
+		self.assertFalse(LexerInput.match(LexerInput.DIGIT, LexerInput.char('٣')))
+		self.assertTrue(LexerInput.match(LexerInput.char('é'), LexerInput.NON_DIGIT))
+		self.assertFalse(LexerInput.match(LexerInput.char('é'), LexerInput.char('e')))
+
+	def test_transition_table_transitions_1(self):
+		table = create_transition_table(""" token a : 'ab'; """)
+		class_count = table.alphabet.class_count
+		self.assertEqual(len(table.transitions), len(table.states) * class_count)
+
+		state = table.states[0]
+		self.assertEqual(table.transitions[class_count * state.index + table.alphabet.classify('a')], state.on('a').index)
+		self.assertEqual(table.transitions[class_count * state.index + table.alphabet.classify('b')], TransitionTable.NO_MOVE)
+		self.assertEqual(state.on('b'), None)
+		self.assertEqual(state.on('a').on('b').rules, ['a'])
+
+	def test_transition_table_skips_1(self):
+		table = create_transition_table(""" token a : 'x' ('\\w' | '\\d')* ;
+		                                    token b : 'é'+ ; """)
+		state = table.states[0].on('x').on('y')
+		self.assertIs(state.on('z'), state)
+		self.assertEqual(state.skip.match('xyé家_z', 1).end(), 4)
+		self.assertEqual(table.states[0].skip, None)
+		self.assertEqual(table.states[0].on('é').on('é').skip.match('éééa', 1).end(), 3)
+		self.assertEqual(TransitionTableTraverser().traverse(table, 'éééxab1家é'), [(0, 3, 'b'), (3, 6, 'a')])
+
+	def test_transition_table_skips_2(self):
+		table = create_transition_table(""" token a : 'x' ('\\w' | '\\d')* ;
+		                                    token b : ' '+ ; """)
+		byte_table = ByteTransitionTableGenerator().generate(table)
+		state = byte_table.states[0].on(ord('x')).on(ord('a'))
+		self.assertIs(state.on(ord('b')), state)
+		self.assertEqual(state.skip.match(b'xabc ', 2).end(), 4)
+		text = 'xab1家  xé'.encode('utf-8')
+		self.assertEqual(TransitionTableTraverser().traverse(byte_table, text), [(0, 7, 'a'), (7, 2, 'b'), (9, 3, 'a')])
+
+	def test_transition_table_rules_1(self):
+		grammar = """ token Identifier : '\\w'+ ;
+		              token Number     : '\\d'+ ;
+		              token Keyword    : 'if' | 'else' ; """
+		table = create_transition_table(grammar)
+		self.assertEqual(table.rules, ['Identifier', 'Number', 'Keyword'])
+		self.assertTrue(all(len(s.rules) <= 1 for s in table.states))
+		self.assertEqual(TransitionTableTraverser().traverse(table, 'if'), [(0, 2, 'Identifier')])
+
+	def test_transition_table_rules_2(self):
+		context = Context()
+		Parser().free_context(SourceIterator(""" token Identifier : '\\w'+ ;
+		                                         token Keyword    : 'if' | 'else' ; """), context)
+		dfa_graph = DFAGraphGenerator().generate(NFAGraphGenerator().generate(context))
+
+		table = TransitionTableGenerator().generate(dfa_graph)
+		self.assertEqual(table.rules, ['Identifier', 'Keyword'])
+		self.assertEqual(TransitionTableTraverser().traverse(table, 'if'), [(0, 2, 'Identifier')])
+
+		table = TransitionTableGenerator().generate(dfa_graph, ['Keyword'])
+		self.assertEqual(table.rules, ['Keyword', 'Identifier'])
+		self.assertEqual(TransitionTableTraverser().traverse(table, 'if'), [(0, 2, 'Keyword')])
+		self.assertEqual(TransitionTableTraverser().traverse(table, 'ifs'), [(0, 3, 'Identifier')])
+
+class TestStreamTraverser(unittest.TestCase):
+	grammar = """ token Whitespace : '\\s' ;
+	              token Identifier : '\\w' ('\\w' | '\\d')* ;
+	              token NotEqual   : '!=' ;
+	              token Not        : '!' ; """
+
+	def test_stream_traverser_1(self):
+		table = create_transition_table(self.grammar)
+		text = 'foo != !bar baz42 !!='
+		expected = TransitionTableTraverser().traverse(table, text)
+		for chunk_size in [1, 2, 3, 7, 100]:
+			result = list(TransitionTableTraverser().traverse_stream(table, io.StringIO(text), chunk_size))
+			self.assertEqual(result, expected)
+
+	def test_stream_traverser_2(self):
+		table = create_transition_table(self.grammar)
+		result = list(TransitionTableTraverser().traverse_stream(table, ['fo', '', 'o !', '=', 'bar']))
+		self.assertEqual(result, [(0, 3, 'Identifier'), (3, 1, 'Whitespace'), (4, 2, 'NotEqual'), (6, 3, 'Identifier')])
+
+	def test_stream_traverser_3(self):
+		table = create_transition_table(self.grammar)
+		tokens = TransitionTableTraverser().traverse_stream(table, ['foo ', 'bar', '?'])
+		self.assertEqual(next(tokens), (0, 3, 'Identifier'))
+		self.assertEqual(next(tokens), (3, 1, 'Whitespace'))
+		self.assertRaises(LexerError, list, tokens)
+
+	def test_stream_traverser_4(self):
+		table = create_transition_table(self.grammar)
+		result = list(TransitionTableTraverser().traverse_stream(table, []))
+		self.assertEqual(result, [])
+
+class TestByteTraverser(unittest.TestCase):
+	grammar = """ token Whitespace : '\\s' ;
+	              token Identifier : '\\w' ('\\w' | '\\d')* ;
+	              token Number     : '\\d'+ ;
+	              token Arrow      : '→' ; """
+
+	def test_byte_traverser_1(self):
+		table = create_transition_table(self.grammar)
+		byte_table = ByteTransitionTableGenerator().generate(table)
+		text = 'habíaunárabe ل 家 → 42 x2'
+		expected = [
+			(len(text[:o].encode('utf-8')), len(text[o:o + l].encode('utf-8')), r)
+			for o, l, r in TransitionTableTraverser().traverse(table, text)]
+		result = TransitionTableTraverser().traverse(byte_table, text.encode('utf-8'))
+		self.assertEqual(result, expected)
+
+	def test_byte_traverser_2(self):
+		byte_table = ByteTransitionTableGenerator().generate(create_transition_table(self.grammar))
+		data = 'x → 1'.encode('utf-8')
+		expected = [(0, 1, 'Identifier'), (1, 1, 'Whitespace'), (2, 3, 'Arrow'), (5, 1, 'Whitespace'), (6, 1, 'Number')]
+		self.assertEqual(TransitionTableTraverser().traverse(byte_table, bytearray(data)), expected)
+		self.assertEqual(TransitionTableTraverser().traverse(byte_table, memoryview(data)), expected)
+		self.assertEqual(list(TransitionTableTraverser().traverse_stream(byte_table, io.BytesIO(data), 2)), expected)
+		chunks = [memoryview(data[i:i + 2]) for i in range(0, len(data), 2)]
+		self.assertEqual(list(TransitionTableTraverser().traverse_stream(byte_table, chunks)), expected)
+
+	def test_byte_traverser_3(self):
+		byte_table = ByteTransitionTableGenerator().generate(create_transition_table(self.grammar))
+		self.assertRaises(LexerError, TransitionTableTraverser().traverse, byte_table, b'ab\xff')
+		self.assertRaises(LexerError, TransitionTableTraverser().traverse, byte_table, b'ab\xc0\x80')
+		self.assertRaises(LexerError, TransitionTableTraverser().traverse, byte_table, b'ab\xed\xa0\x80')
+		self.assertRaises(LexerError, TransitionTableTraverser().traverse, byte_table, b'ab\xe5\xae')
+
+class TestParallelTraverser(unittest.TestCase):
+	grammar = """ token Whitespace : '\\s' ;
+	              token Identifier : '\\w' ('\\w' | '\\d')* ;
+	              token Run        : 'a' 'a'* 'b' | 'a' ;
+	              token NotEqual   : '!=' ;
+	              token Not        : '!' ; """
+
+	def test_parallel_traverser_1(self):
+		table = create_transition_table(self.grammar)
+		text = 'aaab aa x1 != !aab! ab aaaaaaaaaaaaaaaaaaaa aaaaab ' * 20
+		expected = TransitionTableTraverser().traverse(table, text)
+		for chunk_size in [7, 64, 333]:
+			result = TransitionTableTraverser().traverse_parallel(table, text, processes=2, chunk_size=chunk_size)
+			self.assertEqual(result, expected)
+
+	def test_parallel_traverser_2(self):
+		table = create_transition_table(self.grammar)
+		text = 'aaab aa x1 != ' * 20 + '?' + ' aab' * 20
+		self.assertRaises(LexerError, TransitionTableTraverser().traverse_parallel, table, text, 2, 50)
+
+	def test_parallel_traverser_3(self):
+		byte_table = ByteTransitionTableGenerator().generate(create_transition_table(self.grammar))
+		data = 'aaab aa x1 != !aab! ab aaaaaaaaaaaaaaaaaaaa aaaaab '.encode('utf-8') * 20
+		expected = TransitionTableTraverser().traverse(byte_table, data)
+		result = TransitionTableTraverser().traverse_parallel(byte_table, memoryview(data), processes=2, chunk_size=64)
+		self.assertEqual(result, expected)
+
+class TestClassTraverser(unittest.TestCase):
+	grammar = """ token Whitespace : '\\s' -> skip ;
+	              token Identifier : '\\w' ('\\w' | '\\d')* ;
+	              token Number     : '\\d'+ ;
+	              token Run        : 'a' 'a'* 'b' | 'a' ; """
+
+	def test_class_traverser_1(self):
+		table = create_transition_table(self.grammar)
+		for text in ['', 'x1 42   aab a', '家x aé']:
+			text_classes = [table.alphabet.classify(c) for c in text]
+			for hidden in [False, True]:
+				expected = TransitionTableTraverser(hidden=hidden).traverse(table, text)
+				self.assertEqual(TransitionTableTraverser(hidden=hidden).traverse_classes(table, text, text_classes), expected)
+
+	def test_class_traverser_2(self):
+		table = create_transition_table(self.grammar)
+		text = 'ab !'
+		text_classes = [table.alphabet.classify(c) for c in text]
+		with self.assertRaises(LexerError) as context:
+			TransitionTableTraverser().traverse_classes(table, text, text_classes)
+		self.assertEqual(str(context.exception), 'Failed to match \'!\' character')
+		self.assertEqual(TransitionTableTraverser(recover=True).traverse_classes(table, text, text_classes),
+			[(0, 2, 'Identifier'), (3, 1, TransitionTableTraverser.ERROR_RULE)])
+
+class TestLinearTraverser(unittest.TestCase):
+	grammars = [
+		""" token a : 'a'* 'b' | 'a' ; """,
+		""" token a : ('ab' | 'a')* 'c' | 'a' ; token b : 'b' ; """,
+		""" token Run : 'a' 'a'* 'b' | 'a' ; token Whitespace : '\\s' ; token Not : '!' ; token NotEqual : '!=' ; """ ]
+
+	def assertSameResult(self, table, text):
+		try:
+			expected = TransitionTableTraverser().traverse(table, text)
+		except LexerError as e:
+			with self.assertRaises(LexerError) as context:
+				TransitionTableTraverser(linear=True).traverse(table, text)
+			self.assertEqual(str(context.exception), str(e))
+		else:
+			self.assertEqual(TransitionTableTraverser(linear=True).traverse(table, text), expected)
+
+	def test_linear_traverser_1(self):
+		table = create_transition_table(self.grammars[0])
+		self.assertEqual(TransitionTableTraverser(linear=True).traverse(table, 'a' * 300), [(i, 1, 'a') for i in range(300)])
+		self.assertEqual(TransitionTableTraverser(linear=True).traverse(table, 'a' * 100 + 'b'), [(0, 101, 'a')])
+
+	def test_linear_traverser_2(self):
+		texts = ['', 'a', 'aab', 'abababc', 'ababab', 'aaa ab!= !aab', 'aaa ab!= !aa?', 'ab' * 50 + 'x', 'aaaa!']
+		for grammar in self.grammars:
+			table = create_transition_table(grammar)
+			for text in texts:
+				self.assertSameResult(table, text)
+
+	def test_linear_traverser_3(self):
+		table = create_transition_table(self.grammars[2])
+		text = 'aaab aa !!= aaaaaaaa aab ' * 10
+		expected = TransitionTableTraverser().traverse(table, text)
+		for chunk_size in [1, 3, 16]:
+			chunks = [text[i:i + chunk_size] for i in range(0, len(text), chunk_size)]
+			self.assertEqual(list(TransitionTableTraverser(linear=True).traverse_stream(table, chunks)), expected)
+
+class TestRecoveryTraverser(unittest.TestCase):
+	grammar = """ token Whitespace : '\\s' -> skip ;
+	              token Identifier : '\\w' ('\\w' | '\\d')* ;
+	              token NotEqual   : '!=' ; """
+
+	def test_recovery_traverser_1(self):
+		table = create_transition_table(self.grammar)
+		traverser = TransitionTableTraverser(recover=True)
+		result = traverser.traverse(table, 'ab ?? cd !x !=')
+		self.assertEqual(result, [
+			(0, 2, 'Identifier'), (3, 2, TransitionTableTraverser.ERROR_RULE), (6, 2, 'Identifier'),
+			(9, 1, TransitionTableTraverser.ERROR_RULE), (10, 1, 'Identifier'), (12, 2, 'NotEqual')])
+		self.assertEqual(traverser.error_count, 2)
+
+	def test_recovery_traverser_2(self):
+		table = create_transition_table(self.grammar)
+		for linear in [False, True]:
+			traverser = TransitionTableTraverser(linear=linear, recover=True)
+			self.assertEqual(traverser.traverse(table, 'ab!'), [(0, 2, 'Identifier'), (2, 1, TransitionTableTraverser.ERROR_RULE)])
+			self.assertEqual(traverser.traverse(table, '??'), [(0, 2, TransitionTableTraverser.ERROR_RULE)])
+			self.assertEqual(traverser.traverse(table, 'ab'), [(0, 2, 'Identifier')])
+			self.assertEqual(traverser.error_count, 0)
+
+	def test_recovery_traverser_3(self):
+		table = create_transition_table(self.grammar)
+		traverser = TransitionTableTraverser(recover=True)
+		text = 'ab ?? cd !x != ?'
+		expected = traverser.traverse(table, text)
+		for chunk_size in [1, 2, 5]:
+			self.assertEqual(list(traverser.traverse_stream(table, io.StringIO(text), chunk_size)), expected)
+			self.assertEqual(traverser.error_count, 3)
+
+		tokens = traverser.traverse_arrays(table, text)
+		self.assertEqual(list(tokens), expected)
+		self.assertEqual(tokens.rules[-1], TransitionTableTraverser.ERROR_RULE)
+
+		tokens = traverser.traverse_batch(table, [text, 'x'])
+		self.assertEqual(tokens.string_tokens(0), expected)
+		self.assertEqual(traverser.error_count, 3)
+
+class TestTokenArrays(unittest.TestCase):
+	grammar = """ token Whitespace : '\\s' ;
+	              token Identifier : '\\w' ('\\w' | '\\d')* ;
+	              token Number     : '\\d'+ ; """
+
+	def test_token_arrays_1(self):
+		table = create_transition_table(self.grammar)
+		text = 'abc 12 x1  y'
+		tokens = TransitionTableTraverser().traverse_arrays(table, text)
+		expected = TransitionTableTraverser().traverse(table, text)
+
+		self.assertEqual(len(tokens), len(expected))
+		self.assertEqual(list(tokens), expected)
+		self.assertEqual(tokens[0], expected[0])
+		self.assertEqual(tokens[-1], expected[-1])
+		self.assertEqual(tokens[1:4], expected[1:4])
+		self.assertEqual(tokens.rules, ['Whitespace', 'Identifier', 'Number'])
+		self.assertEqual(tokens.offsets.typecode, 'q')
+		self.assertEqual(tokens.rule_ids.typecode, 'i')
+		self.assertEqual(list(tokens.rule_ids[:3]), [1, 0, 2])
+
+	def test_token_arrays_2(self):
+		table = create_transition_table(self.grammar)
+		self.assertEqual(len(TransitionTableTraverser().traverse_arrays(table, '')), 0)
+		self.assertRaises(LexerError, TransitionTableTraverser().traverse_arrays, table, 'abc ?')
+
+	def test_token_arrays_3(self):
+		try:
+			import numpy
+		except ImportError:
+			self.skipTest('NumPy is not available.')
+
+		table = create_transition_table(self.grammar)
+		tokens = TransitionTableTraverser().traverse_arrays(table, 'abc 12 x1')
+		offsets, lengths, rule_ids = tokens.to_numpy()
+		self.assertEqual(offsets.tolist(), [0, 3, 4, 6, 7])
+		self.assertEqual(lengths.tolist(), [3, 1, 2, 1, 2])
+		self.assertEqual(rule_ids.tolist(), [1, 0, 2, 0, 1])
+
+class TestBatchTraverser(unittest.TestCase):
+	grammar = """ token Whitespace : '\\s' -> skip ;
+	              token Identifier : '\\w' ('\\w' | '\\d')* ;
+	              token Number     : '\\d'+ ;
+	              token Colon      : ':' ; """
+
+	texts = ['host1: error 42', '', 'x', '  ', 'a:b:c 1']
+
+	def test_batch_traverser_1(self):
+		table = create_transition_table(self.grammar)
+		for traverser in [TransitionTableTraverser(), TransitionTableTraverser(linear=True)]:
+			tokens = traverser.traverse_batch(table, self.texts)
+			self.assertEqual(tokens.string_count(), len(self.texts))
+			self.assertEqual(list(tokens.starts), [0, 4, 4, 5, 5, 11])
+			for index, text in enumerate(self.texts):
+				self.assertEqual(tokens.string_tokens(index), TransitionTableTraverser().traverse(table, text))
+
+	def test_batch_traverser_2(self):
+		table = create_transition_table(self.grammar)
+		expected = TransitionTableTraverser().traverse_batch(table, self.texts * 10)
+		result = TransitionTableTraverser().traverse_batch(table, self.texts * 10, processes=2, batch_size=7)
+		self.assertEqual(list(result.starts), list(expected.starts))
+		self.assertEqual(result, expected)
+
+	def test_batch_traverser_3(self):
+		table = create_transition_table(self.grammar)
+		with self.assertRaises(LexerError) as context:
+			TransitionTableTraverser().traverse_batch(table, ['ab', 'c?d'])
+		self.assertEqual(str(context.exception), 'String 1: Failed to match \'?\' character')
+
+@unittest.skipIf(spgen_numpy is None, 'NumPy is not available.')
+class TestNumpyBatchTraverser(unittest.TestCase):
+	grammar = """ token Whitespace : '\\s' -> skip ;
+	              token Comment    : '#' '\\w'* -> hidden ;
+	              token Identifier : '\\w' ('\\w' | '\\d')* ;
+	              token Number     : '\\d'+ ;
+	              token Run        : 'a' 'a'* 'b' | ':' ; """
+
+	texts = ['host1: error 42', '', 'x', '  ', 'a:b:c 1 #x', 'aaaa aab 家 é', 'aaaaaa']
+
+	def test_numpy_batch_traverser_1(self):
+		table = create_transition_table(self.grammar)
+		numpy_table = spgen_numpy.NumpyTransitionTableGenerator().generate(table)
+		for hidden in [False, True]:
+			expected = TransitionTableTraverser(hidden=hidden).traverse_batch(table, self.texts)
+			result = spgen_numpy.NumpyBatchTraverser(hidden).traverse_batch(numpy_table, self.texts)
+			self.assertEqual(list(result.starts), list(expected.starts))
+			self.assertEqual(result, expected)
+
+	def test_numpy_batch_traverser_2(self):
+		table = create_transition_table(self.grammar)
+		numpy_table = spgen_numpy.NumpyTransitionTableGenerator().generate(table)
+		result = spgen_numpy.NumpyBatchTraverser().traverse_batch(numpy_table, [])
+		self.assertEqual(list(result.starts), [0])
+		self.assertEqual(len(result), 0)
+
+	def test_numpy_batch_traverser_3(self):
+		table = create_transition_table(self.grammar)
+		numpy_table = spgen_numpy.NumpyTransitionTableGenerator().generate(table)
+		for texts in [['ab', 'c?d', '?'], ['ab', 'x', 'a #?']]:
+			with self.assertRaises(LexerError) as expected:
+				TransitionTableTraverser().traverse_batch(table, texts)
+			with self.assertRaises(LexerError) as result:
+				spgen_numpy.NumpyBatchTraverser().traverse_batch(numpy_table, texts)
+			self.assertEqual(str(result.exception), str(expected.exception))
+
+@unittest.skipIf(spgen_numpy is None, 'NumPy is not available.')
+class TestNumpyTraverser(unittest.TestCase):
+	grammar = """ token Whitespace : '\\s' -> skip ;
+	              token Comment    : '#' '\\w'* -> hidden ;
+	              token Identifier : '\\w' ('\\w' | '\\d')* | 'é' '€' ;
+	              token Number     : '\\d'+ | '٣' ;
+	              token Other      : '€' | '?' ; """
+
+	def test_numpy_traverser_classify_1(self):
+		table = create_transition_table(self.grammar)
+		numpy_table = spgen_numpy.NumpyTransitionTableGenerator().generate(table)
+		text = 'a1 #?é€٣٤家\U0001F600\x00\U0010FFFF'
+		self.assertEqual(numpy_table.classify(text).tolist(), [table.alphabet.classify(c) for c in text])
+		self.assertEqual(len(numpy_table.classify('')), 0)
+
+	def test_numpy_traverser_1(self):
+		table = create_transition_table(self.grammar)
+		numpy_table = spgen_numpy.NumpyTransitionTableGenerator().generate(table)
+		for text in ['host1 error 42', '', 'é€ é € x٣ #y ?', 'aaa 家家 #']:
+			for hidden in [False, True]:
+				expected = TransitionTableTraverser(hidden=hidden).traverse(table, text)
+				self.assertEqual(spgen_numpy.NumpyTraverser(hidden).traverse(numpy_table, text), expected)
+
+	def test_numpy_traverser_2(self):
+		table = create_transition_table(self.grammar)
+		numpy_table = spgen_numpy.NumpyTransitionTableGenerator().generate(table)
+		with self.assertRaises(LexerError) as context:
+			spgen_numpy.NumpyTraverser().traverse(numpy_table, 'ab !')
+		self.assertEqual(str(context.exception), 'Failed to match \'!\' character')
+
+class TestLineIndex(unittest.TestCase):
+	grammar = """ token Whitespace : '\\s' ;
+	              token Identifier : '\\w' ('\\w' | '\\d')* ; """
+
+	def test_line_index_1(self):
+		line_index = LineIndex('ab\ncd\n\nef')
+		self.assertEqual(list(line_index.line_starts), [0, 3, 6, 7])
+		self.assertEqual(line_index.position(0), (1, 1))
+		self.assertEqual(line_index.position(2), (1, 3))
+		self.assertEqual(line_index.position(3), (2, 1))
+		self.assertEqual(line_index.position(6), (3, 1))
+		self.assertEqual(line_index.position(8), (4, 2))
+
+	def test_line_index_2(self):
+		line_index = LineIndex()
+		for chunk in ['a', 'b\nc', '\n', '', 'de\n']:
+			line_index.add_text(chunk)
+		self.assertEqual(list(line_index.line_starts), list(LineIndex('ab\nc\nde\n').line_starts))
+		self.assertEqual(list(LineIndex(b'ab\nc\n').line_starts), [0, 3, 5])
+
+	def test_line_index_3(self):
+		table = create_transition_table(self.grammar)
+		text = 'foo bar\n  baz\nx'
+		line_index = LineIndex()
+		tokens = list(TransitionTableTraverser().traverse_stream(table, io.StringIO(text), 4, line_index))
+		self.assertEqual(list(line_index.line_starts), list(LineIndex(text).line_starts))
+
+		lines, columns = line_index.positions([offset for offset, length, rule in tokens if rule == 'Identifier'])
+		self.assertEqual(list(zip(lines, columns)), [(1, 1), (1, 5), (2, 3), (3, 1)])
+
+	def test_line_index_4(self):
+		try:
+			import numpy
+		except ImportError:
+			self.skipTest('NumPy is not available.')
+
+		table = create_transition_table(self.grammar)
+		text = 'foo bar\n  baz\nx'
+		line_index = LineIndex()
+		tokens = TransitionTableTraverser().traverse_arrays(table, text)
+		line_index.add_text(text)
+		offsets, lengths, rule_ids = tokens.to_numpy()
+		lines, columns = line_index.positions(offsets)
+		expected_lines, expected_columns = line_index.positions(tokens.offsets)
+		self.assertEqual(lines.tolist(), list(expected_lines))
+		self.assertEqual(columns.tolist(), list(expected_columns))
+
+class TestTokenListener(unittest.TestCase):
+	grammar = """ token Whitespace : '\\s' ;
+	              token Identifier : '\\w' ('\\w' | '\\d')* ;
+	              token Number     : '\\d'+ ; """
+
+	class Recorder(AbstractTokenListener):
+		def __init__(self):
+			self.calls = []
+
+		def before_token(self, info):
+			self.calls.append(('before', info.offset, info.length, info.rule))
+
+		def after_token(self, info):
+			self.calls.append(('after', info.string))
+
+		def visit_Number(self, info):
+			self.calls.append(('number', int(info.string)))
+
+	def test_iter_tokens_1(self):
+		table = create_transition_table(self.grammar)
+		text = 'abc 12 x1'
+		tokens = TransitionTableTraverser().iter_tokens(table, text)
+		self.assertEqual(next(tokens), (0, 3, 'Identifier'))
+		self.assertEqual(list(tokens), TransitionTableTraverser().traverse(table, text)[1:])
+
+	def test_iter_tokens_2(self):
+		table = create_transition_table(self.grammar)
+		tokens = TransitionTableTraverser().iter_tokens(table, 'abc 12 ?')
+		self.assertEqual(next(tokens), (0, 3, 'Identifier'))
+		self.assertRaises(LexerError, list, tokens)
+
+	def test_token_listener_1(self):
+		table = create_transition_table(self.grammar)
+		listener = self.Recorder()
+		TransitionTableTraverser().process(table, 'ab 12', listener)
+		self.assertEqual(listener.calls, [
+			('before', 0, 2, 'Identifier'), ('after', 'ab'),
+			('before', 2, 1, 'Whitespace'), ('after', ' '),
+			('before', 3, 2, 'Number'), ('number', 12), ('after', '12')])
+
+class TestIncrementalTraverser(unittest.TestCase):
+	grammar = """ token Whitespace : '\\s' ;
+	              token Identifier : '\\w' ('\\w' | '\\d')* ;
+	              token Number     : '\\d'+ ;
+	              token Run        : 'x' 'y'* 'z' ;
+	              token Y          : 'y' ; """
+
+	def assertEdits(self, text, edits):
+		table = create_transition_table(self.grammar)
+		traverser = IncrementalTraverser(table, text)
+		for offset, removed, inserted in edits:
+			text = text[:offset] + inserted + text[offset + removed:]
+			tokens = traverser.tokens
+			index, count, new_tokens, delta = traverser.edit(offset, removed, inserted)
+			# The patch applied to the previous tokens, with the tokens after it shifted.
+			tokens[index:] = new_tokens + [(o + delta, l, r) for o, l, r in tokens[index + count:]]
+			expected = TransitionTableTraverser().traverse(table, text)
+			self.assertEqual(tokens, expected)
+			self.assertEqual(traverser.tokens, expected)
+			self.assertEqual(traverser.text, text)
+
+	def test_incremental_traverser_1(self):
+		self.assertEdits('abc 12 x1', [(3, 0, 'd'), (0, 0, '9'), (10, 0, ' 5'), (4, 1, ''), (0, 12, '')])
+
+	def test_incremental_traverser_2(self):
+		self.assertEdits('', [(0, 0, 'ab'), (1, 0, ' '), (3, 0, '1'), (1, 1, '')])
+
+	def test_incremental_traverser_3(self):
+		# The edit changes a token that ended long before it.
+		self.assertEdits('xyyyy xyyyy', [(5, 0, 'z'), (5, 1, ''), (11, 0, 'z'), (0, 1, '')])
+
+	def test_incremental_traverser_4(self):
+		table = create_transition_table(self.grammar)
+		traverser = IncrementalTraverser(table, 'ab cd')
+		self.assertRaises(LexerError, traverser.edit, 2, 1, '?')
+		self.assertEqual(traverser.text, 'ab cd')
+		self.assertEqual(traverser.tokens, TransitionTableTraverser().traverse(table, 'ab cd'))
+
+	def test_incremental_traverser_5(self):
+		# Edits across and around the boundaries of the token blocks.
+		text = 'ab 12 xyyz ' * 100
+		self.assertEdits(text, [(1020, 0, 'q'), (0, 2, ''), (700, 10, ' '), (500, 400, 'y'), (5, 0, 'xyyyy ' * 80), (0, 100, '')])
+
+class TestTokenChannels(unittest.TestCase):
+	grammar = """ token Whitespace : '\\s'+ -> skip ;
+	              token Comment    : '#' '\\w'* -> hidden ;
+	              token Identifier : '\\w'+ ;
+	              token Not        : '!' ; """
+
+	def test_token_channels_1(self):
+		table = create_transition_table(self.grammar)
+		text = 'ab  #cd !x'
+		self.assertEqual(TransitionTableTraverser().traverse(table, text), [(0, 2, 'Identifier'), (8, 1, 'Not'), (9, 1, 'Identifier')])
+		self.assertEqual(TransitionTableTraverser(hidden=True).traverse(table, text), [(0, 2, 'Identifier'), (4, 3, 'Comment'), (8, 1, 'Not'), (9, 1, 'Identifier')])
+		self.assertEqual(TransitionTableTraverser(linear=True).traverse(table, text), TransitionTableTraverser().traverse(table, text))
+		self.assertEqual(TransitionTableTraverser().traverse(table, '   '), [])
+		self.assertRaises(LexerError, TransitionTableTraverser().traverse, table, 'ab ?')
+
+	def test_token_channels_2(self):
+		table, lexer = create_python_lexer(self.grammar)
+		text = 'ab  #cd !x'
+		for hidden in [False, True]:
+			expected = TransitionTableTraverser(hidden=hidden).traverse(table, text)
+			result = [(offset, length, lexer.RULES[rule]) for offset, length, rule in lexer.tokenize(text, hidden)]
+			self.assertEqual(result, expected)
+
+	def test_token_channels_3(self):
+		master_pattern = create_master_pattern(self.grammar)
+		text = 'ab  #cd !x'
+		for hidden in [False, True]:
+			expected = TransitionTableTraverser(hidden=hidden).traverse(master_pattern.transition_table, text)
+			self.assertEqual(MasterPatternTraverser(hidden=hidden).traverse(master_pattern, text), expected)
+
+def create_python_lexer(grammar):
+	context = Context()
+	context.properties['defaultModuleName'] = 'Test'
+	context.properties['outputPythonModule'] = 'TestLexer.py'
+	Parser().free_context(SourceIterator(grammar), context)
+	transition_table = create_transition_table(grammar)
+	source = generators.python.generate_module_source(transition_table, context.rules, context.properties)
+
+	module = types.ModuleType('TestLexer')
+	exec(compile(source, 'TestLexer.py', 'exec'), module.__dict__)
+	return transition_table, module
+
+class TestPythonGenerator(unittest.TestCase):
+	grammar = """ token Whitespace : '\\s' ;
+	              token Identifier : Letter LetterOrDigit* ;
+	              token FixedToken : 'token' ;
+	              token Arrow      : '→' ;
+	              token NotEqual   : '!=' ;
+	              token Not        : '!' ;
+	              fragment LetterOrDigit : Letter | Digit ;
+	              fragment Letter : '\\w' ;
+	              fragment Digit  : '\\d' ; """
+
+	def test_python_generator_1(self):
+		table, lexer = create_python_lexer(self.grammar)
+		text = 'token x1 != !家 → tokens'
+		expected = TransitionTableTraverser().traverse(table, text)
+		result = [(offset, length, lexer.RULES[rule]) for offset, length, rule in lexer.tokenize(text)]
+		self.assertEqual(result, expected)
+
+	def test_python_generator_2(self):
+		table, lexer = create_python_lexer(self.grammar)
+		self.assertEqual(lexer.tokenize('!=x'), [(0, 2, lexer.NotEqualToken), (2, 1, lexer.IdentifierToken)])
+		self.assertRaises(lexer.LexerError, lexer.tokenize, 'x = y')
+
+	def test_python_generator_3(self):
+		# The output directory is created if it doesn't exist.
+		context = Context()
+		context.properties['defaultModuleName'] = 'Test'
+		Parser().free_context(SourceIterator(self.grammar), context)
+		with tempfile.TemporaryDirectory() as directory:
+			context.properties['outputDirectory'] = os.path.join(directory, 'gen')
+			with contextlib.redirect_stdout(io.StringIO()):
+				generators.python.generate_code(spgen.GeneratorTaskInfo(
+					create_transition_table(self.grammar), context.properties, context.rules))
+			self.assertTrue(os.path.isfile(os.path.join(directory, 'gen', 'TestLexer.py')))
+
+def create_master_pattern(grammar, generator=MasterPatternGenerator):
+	context = Context()
+	Parser().free_context(SourceIterator(grammar), context)
+	return generator().generate(context, create_transition_table(grammar))
+
+class TestMasterPattern(unittest.TestCase):
+	grammar = """ token Number   : '\\d'+ ('.' '\\d'+)? ;
+	              token Id       : 'x' 'y'* ;
+	              token Xyz      : 'xyz' ;
+	              token Ws       : ' '+ ;
+	              token NotEqual : '!=' ;
+	              token Not      : '!' ;
+	              token Blank    : Tab* ;
+	              fragment Tab   : '\\t' ; """
+
+	def test_master_pattern_1(self):
+		master_pattern = create_master_pattern(self.grammar)
+		self.assertEqual(master_pattern.fallback_reason, None)
+
+		text = '12 3.25!=!xyyy xyz xy\t\t!x'
+		result = MasterPatternTraverser().traverse(master_pattern, text)
+		self.assertEqual(result, TransitionTableTraverser().traverse(master_pattern.transition_table, text))
+
+	def test_master_pattern_2(self):
+		master_pattern = create_master_pattern(self.grammar)
+		self.assertEqual(MasterPatternTraverser().traverse(master_pattern, 'xyz'), [(0, 3, 'Xyz')])
+		self.assertEqual(MasterPatternTraverser().traverse(master_pattern, 'xyy!='), [(0, 3, 'Id'), (3, 2, 'NotEqual')])
+		self.assertRaises(LexerError, MasterPatternTraverser().traverse, master_pattern, '12.')
+		self.assertRaises(LexerError, MasterPatternTraverser().traverse, master_pattern, '1?')
+
+	def test_master_pattern_3(self):
+		master_pattern = create_master_pattern(""" token a : 'a' | 'ab' ; """)
+		self.assertNotEqual(master_pattern.fallback_reason, None)
+		self.assertEqual(MasterPatternTraverser().traverse(master_pattern, 'aba'), [(0, 2, 'a'), (2, 1, 'a')])
+
+	def test_master_pattern_4(self):
+		master_pattern = create_master_pattern(""" token a : '\\w'* ;
+		                                           token b : 'var' ; """)
+		self.assertEqual(master_pattern.fallback_reason, None)
+		self.assertEqual(MasterPatternTraverser().traverse(master_pattern, 'var'), [(0, 3, 'a')])
+		self.assertEqual(MasterPatternTraverser().traverse(master_pattern, 'vax'), [(0, 3, 'a')])
+
+	def test_master_pattern_5(self):
+		master_pattern = create_master_pattern(""" token Xy : 'xy' ;
+		                                           token Id : 'x' 'y'* ; """)
+		self.assertEqual(master_pattern.fallback_reason, None)
+		self.assertEqual(MasterPatternTraverser().traverse(master_pattern, 'xyxyy'), [(0, 2, 'Xy'), (2, 3, 'Id')])
+
+	class UncheckedGenerator(MasterPatternGenerator):
+		def check_empty_matches(self, name, expression):
+			return None
+
+	def assertEmptyMatches(self, grammar, text, expected):
+		# The rules fall back to the transition table, and the traverser hands off to it
+		# on empty matches even when the pattern is used.
+		master_pattern = create_master_pattern(grammar)
+		self.assertNotEqual(master_pattern.fallback_reason, None)
+		unchecked_pattern = create_master_pattern(grammar, self.UncheckedGenerator)
+		self.assertEqual(unchecked_pattern.fallback_reason, None)
+		for master_pattern in [master_pattern, unchecked_pattern]:
+			if expected is None:
+				self.assertRaises(LexerError, MasterPatternTraverser().traverse, master_pattern, text)
+			else:
+				self.assertEqual(MasterPatternTraverser().traverse(master_pattern, text), expected)
+
+	def test_master_pattern_6(self):
+		self.assertEmptyMatches(""" token a : ('x' 'y')* | '\\d' ; """, '1', [(0, 1, 'a')])
+
+	def test_master_pattern_7(self):
+		self.assertEmptyMatches(""" token a : ('b' 'c')? | '\\d'* ;
+		                            token b : '\\w' ; """, 'b1', [(0, 1, 'b'), (1, 1, 'a')])
+
+	def test_master_pattern_8(self):
+		self.assertEmptyMatches(""" token a : ('a' 'b')? ;
+		                            token b : 'x' ; """, 'ax', None)
+
+	def test_master_pattern_9(self):
+		master_pattern = create_master_pattern(""" token If : 'if' ;
+		                                           token Id : '\\w'+ ;
+		                                           token Ws : ' ' ;
+		                                           token Else : 'else' ; """)
+		self.assertEqual(master_pattern.fallback_reason, None)
+		self.assertEqual(master_pattern.keywords, { 'if' : 'If', 'else' : 'Else' })
+		self.assertEqual(master_pattern.keyword_rules, set(['Id']))
+
+		text = 'if iff else elsewhere i'
+		result = MasterPatternTraverser().traverse(master_pattern, text)
+		self.assertEqual(result, [(0, 2, 'If'), (2, 1, 'Ws'), (3, 3, 'Id'), (6, 1, 'Ws'), (7, 4, 'Id'),
+			(11, 1, 'Ws'), (12, 9, 'Id'), (21, 1, 'Ws'), (22, 1, 'Id')])
+		self.assertEqual(result, TransitionTableTraverser().traverse(master_pattern.transition_table, text))
 
 if __name__ == '__main__':
 	unittest.main()